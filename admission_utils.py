@@ -0,0 +1,155 @@
+"""
+Admission Utils
+---------------
+Kontrol penerimaan (admission) request enhance berdasarkan budget memori proses:
+- Estimasi peak memori per request dari ukuran input, scale, dan mode enhance
+- Request yang tidak muat di budget menunggu di antrean (dengan batas waktu) atau langsung ditolak
+- Pengukuran peak RSS nyata selama request untuk dibandingkan dengan estimasi
+
+Created by _drat | 2025
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from resolution_utils import plan_resolution
+from tile_utils import TILE_MEMORY_BUDGET_MB, bytes_per_pixel
+from trace_utils import current_rss, metrics, span
+
+# Budget memori proses untuk semua request enhance yang berjalan bersamaan (0 = tanpa batas)
+ADMISSION_BUDGET_MB = int(os.environ.get('ADMISSION_BUDGET_MB', 8192))
+# Lama maksimum menunggu di antrean sebelum request ditolak (detik)
+ADMISSION_TIMEOUT_S = float(os.environ.get('ADMISSION_TIMEOUT_S', 30))
+# Overhead tetap GFPGAN (align/warp, mask paste back per wajah) untuk mode wajah
+FACE_OVERHEAD_MB = 512
+# Interval sampling RSS untuk pengukuran peak (detik)
+RSS_SAMPLE_INTERVAL_S = 0.02
+
+
+class MemoryBudgetError(RuntimeError):
+    pass
+
+
+# Fungsi estimasi peak memori (byte) satu request enhance, mengikuti salinan full-frame di run_enhance
+def estimate_enhance_bytes(width, height, scale, enhance_mode):
+    plan = plan_resolution(width, height, scale, enhance_mode)
+    input_px = width * height
+    resized_px = plan.resized_size[0] * plan.resized_size[1]
+    model_px = resized_px * plan.model_scale * plan.model_scale
+    target_px = plan.target_size[0] * plan.target_size[1]
+
+    total = 3 * input_px                      # Decode PIL -> BGR (konversi warna in-place)
+    total += 3 * resized_px                   # Pre-resize
+    total += 4 * 3 * resized_px               # Tensor input model (float32)
+    total += (4 * 3 + 4) * model_px           # Tensor output / akumulator tile + bobot (float32)
+    total += min(TILE_MEMORY_BUDGET_MB * 1024 * 1024, resized_px * bytes_per_pixel())  # Aktivasi model
+    total += 3 * model_px                     # Output uint8
+    total += 2 * 3 * target_px                # Clamp resize + PIL
+    if enhance_mode != "Only Image Enhance":
+        total += FACE_OVERHEAD_MB * 1024 * 1024 + 4 * 3 * 2 * target_px  # Paste back wajah (float32)
+    return total
+
+
+class PeakRSSSampler:
+    # Sampling RSS proses di thread background; peak_delta = peak selama sampling - RSS awal
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL_S):
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.baseline = self.peak = current_rss()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    @property
+    def peak_delta(self):
+        return max(0, self.peak - self.baseline)
+
+
+class AdmissionController:
+    def __init__(self, budget_mb: int = ADMISSION_BUDGET_MB, timeout_s: float = ADMISSION_TIMEOUT_S):
+        self.budget_bytes = budget_mb * 1024 * 1024
+        self.timeout_s = timeout_s
+        self.in_use = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.peak_in_use = 0
+        self._condition = threading.Condition()
+
+    # Context manager: tunggu sampai estimasi muat di budget, lalu ukur peak nyata selama request berjalan.
+    # Raise MemoryBudgetError jika estimasi melebihi budget total atau antrean melewati batas waktu
+    @contextmanager
+    def admit(self, estimated_bytes, name='request'):
+        if self.budget_bytes <= 0:
+            with PeakRSSSampler() as sampler:
+                yield sampler
+            return
+
+        if estimated_bytes > self.budget_bytes:
+            with self._condition:
+                self.rejected += 1
+            raise MemoryBudgetError(
+                f'Gambar terlalu besar: estimasi memori {estimated_bytes / 2**20:.0f} MB '
+                f'melebihi budget {self.budget_bytes / 2**20:.0f} MB'
+            )
+
+        with span('admission', estimated_mb=round(estimated_bytes / 2**20, 1)) as attrs:
+            start = time.monotonic()
+            with self._condition:
+                self.waiting += 1
+                try:
+                    fits = self._condition.wait_for(
+                        lambda: self.in_use + estimated_bytes <= self.budget_bytes, timeout=self.timeout_s
+                    )
+                finally:
+                    self.waiting -= 1
+                if not fits:
+                    self.rejected += 1
+                    raise MemoryBudgetError('Server sedang penuh, silakan coba lagi sebentar lagi')
+                self.in_use += estimated_bytes
+                self.admitted += 1
+                self.peak_in_use = max(self.peak_in_use, self.in_use)
+            attrs['queued_ms'] = round((time.monotonic() - start) * 1000, 2)
+
+        sampler = PeakRSSSampler()
+        with span('admitted', request=name, estimated_mb=round(estimated_bytes / 2**20, 1)) as attrs:
+            try:
+                with sampler:
+                    yield sampler
+            finally:
+                with self._condition:
+                    self.in_use -= estimated_bytes
+                    self._condition.notify_all()
+                attrs['measured_mb'] = round(sampler.peak_delta / 2**20, 1)  # Peak RSS delta, bandingkan dengan estimated_mb
+
+    def stats(self):
+        with self._condition:
+            return {
+                'budget_bytes': self.budget_bytes,
+                'in_use_bytes': self.in_use,
+                'peak_in_use_bytes': self.peak_in_use,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+            }
+
+
+# Controller global untuk request enhance (statistiknya ikut diekspor di endpoint metrik)
+admission = AdmissionController()
+metrics.register_stats('admission', admission.stats)
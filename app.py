@@ -7,11 +7,17 @@ Untuk versi ini, hanya ada 1 tab "Enhance" yang memanggil demo dari modul app_en
 Created by _drat | 2025
 """
 
+import os
+import time
+_import_start = time.perf_counter()  # Untuk laporan waktu startup
+
 import gradio as gr
 
 from app_enhance import create_demo as create_demo_enhance  # Import fungsi untuk membangun demo UI 'Enhance'
 # from app_upscale import create_demo as create_demo_upscale  # Import fungsi untuk membangun demo UI 'Upscale'
 from themes import IndonesiaTheme  # Impor tema custom
+from model_utils import record_startup, startup_report, warmup  # Provider model bersama (lazy)
+from trace_utils import start_metrics_server  # Endpoint metrik (Prometheus / JSON)
 
 import warnings
 warnings.filterwarnings("ignore")
@@ -75,5 +81,20 @@ with gr.Blocks(css=css, theme=IndonesiaTheme()) as demo:
         # with gr.Tab(label="🚀 Upscale"):
         #     create_demo_upscale()   # Panggil UI Upscale dari app_upscale.py (atau sesuai modul Anda)
 
-# Jalankan aplikasi Gradio (local/web)
-demo.queue(api_open=False).launch(show_api=False)
+record_startup('module:app', time.perf_counter() - _import_start)
+
+# Hanya saat dijalankan langsung (worker process inference dengan start method spawn meng-import ulang modul ini)
+if __name__ == '__main__':
+    # Opsional: bangun semua model sebelum request pertama (MODEL_WARMUP=1), default lazy saat pertama dipakai
+    if os.environ.get('MODEL_WARMUP', '0') == '1':
+        warmup()
+    print(startup_report(as_text=True))  # Laporan waktu startup per modul & model
+
+    # Opsional: endpoint metrik latency/throughput/memori per stage di http://host:METRICS_PORT/metrics
+    if os.environ.get('METRICS_PORT'):
+        start_metrics_server(int(os.environ['METRICS_PORT']))
+
+    # Jalankan aplikasi Gradio (local/web); Gradio meneruskan banyak event sekaligus, penjadwalan per model
+    # (concurrency, batas antrean, lane prioritas) dilakukan oleh antrean di queue_utils
+    GRADIO_CONCURRENCY = int(os.environ.get('GRADIO_CONCURRENCY', 16))
+    demo.queue(api_open=False, default_concurrency_limit=GRADIO_CONCURRENCY).launch(show_api=False)
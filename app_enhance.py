@@ -9,128 +9,177 @@ Created by _drat | 2025
 """
 
 # Import library standar dan eksternal yang dibutuhkan
-import os
-import subprocess
+import time
+_import_start = time.perf_counter()  # Untuk laporan waktu startup per modul
+
 import spaces  # Library dari HuggingFace untuk GPU management & dekorator
-import torch   # Library untuk deep learning, cek GPU
 import cv2     # OpenCV untuk pengolahan gambar
-import uuid    # Untuk generate nama file unik
 import gradio as gr # Untuk membuat UI web berbasis Python
 import numpy as np  # Operasi numerik, termasuk array
 
 from PIL import Image   # Untuk memproses dan menyimpan gambar
-# Import arsitektur model dan utilitas untuk enhancement & upscaling
-from basicsr.archs.srvgg_arch import SRVGGNetCompact
-from gfpgan.utils import GFPGANer
-from realesrgan.utils import RealESRGANer
+# Provider model bersama: Real-ESRGAN & GFPGANer dibangun saat pertama dipakai (bukan saat import)
+from model_utils import get_face_enhancer, get_upsampler, record_startup
+from cache_utils import hash_image, make_key, result_cache  # Cache hasil berbasis hash piksel + parameter
+from face_utils import enhance_faces  # GFPGAN dengan deteksi wajah di salinan kecil + cache deteksi
+from output_utils import output_store, wait_for_output  # Encoder file hasil di background + batas folder output
+from resolution_utils import plan_resolution  # Perencana resolusi output sebelum inference
+from trace_utils import breakdown, request_trace, span  # Span waktu per stage & metrik
+from admission_utils import MemoryBudgetError, admission, estimate_enhance_bytes  # Admission berbasis budget memori
+from stream_utils import PREVIEW_MAX_SIZE, Throttle, compose_preview, quick_preview, stream_call  # Preview bertahap
+from queue_utils import QueueFullError, get_queue  # Antrean per model dengan backpressure & lane prioritas
+from worker_utils import WorkerCrashedError, get_worker_pool, workers_enabled  # Worker process opsional (shared memory)
 
 import warnings
 warnings.filterwarnings("ignore")
 
-# Fungsi untuk menjalankan command shell (misal: wget file model)
-def runcmd(cmd, verbose = False):
-    process = subprocess.Popen(
-        cmd,
-        stdout = subprocess.PIPE,
-        stderr = subprocess.PIPE,
-        text = True,
-        shell = True
-    )
-    std_out, std_err = process.communicate()
-    if verbose:
-        print(std_out.strip(), std_err)
-    pass
-
-# Pastikan model AI (GFPGAN dan RealESRGAN) sudah terdownload. Jika belum, otomatis download.
-if not os.path.exists('GFPGANv1.4.pth'):
-    runcmd("wget https://github.com/TencentARC/GFPGAN/releases/download/v1.3.0/GFPGANv1.4.pth -P .")
-if not os.path.exists('realesr-general-x4v3.pth'):
-    runcmd("wget https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-x4v3.pth -P .")
-
-# Inisialisasi model Real-ESRGAN untuk upscaling gambar
-model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type='prelu')
-model_path = 'realesr-general-x4v3.pth'
-half = True if torch.cuda.is_available() else False  # Pakai mode half-precision jika ada GPU (lebih cepat)
-upsampler = RealESRGANer(
-    scale=4, model_path=model_path, model=model, 
-    tile=0, tile_pad=10, pre_pad=0, half=half
-)
-
-# Fungsi utama untuk enhance gambar (dipanggil saat tombol di UI ditekan)
-@spaces.GPU(duration=15)
+# Fungsi utama untuk enhance gambar (dipanggil saat tombol di UI ditekan), berbasis generator:
+# preview interpolasi langsung dikirim, lalu hasil parsial per kelompok tile (di-throttle), lalu hasil akhir.
+# Hasil yang sama (piksel + scale + mode) diambil dari cache tanpa alokasi GPU
 def enhance_image(
     input_image: Image,      # Gambar input dari user (PIL Image)
     scale: int,              # Skala upscaling (misal: 2x, 4x)
     enhance_mode: str,       # Mode enhance: face saja, image saja, atau keduanya
+):
+    # Seluruh request berjalan di satu thread pekerja (trace tetap utuh), generator ini hanya meneruskan hasilnya
+    yield from stream_call(_enhance_request, input_image, scale, enhance_mode)
+
+# Satu request enhance; emit((gambar, path, info)) untuk setiap preview
+def _enhance_request(emit, input_image, scale, enhance_mode):
+    with request_trace('enhance', size=input_image.size, mode=enhance_mode, scale=int(scale)) as trace:
+        with span('cache_lookup') as attrs:
+            key = make_key('enhance', input_image, scale=int(scale), enhance_mode=enhance_mode)
+            cached = result_cache.get(key)
+            attrs['hit'] = cached is not None
+
+        if cached is not None:
+            images, _, paths = cached
+            enhanced_image, enhanced_path = images[0], paths[0]
+        else:
+            with span('preview'):
+                emit((quick_preview(input_image), None, {'status': 'preview'}))
+
+            # Antrean model (Real-ESRGAN saja / GFPGAN): gambar kecil didahulukan, antrean penuh langsung ditolak.
+            # Budget memori baru dipesan setelah dapat slot: request yang masih antre tidak memakan budget,
+            # jadi antrean panjang di satu model tidak membuat request model lain ditolak di admission
+            model_queue = get_queue('realesrgan' if enhance_mode == "Only Image Enhance" else 'gfpgan')
+            estimated_bytes = estimate_enhance_bytes(input_image.width, input_image.height, scale, enhance_mode)
+            try:
+                with model_queue.slot(pixels=input_image.width * input_image.height), \
+                        admission.admit(estimated_bytes, name='enhance'):
+                    enhanced_image = None
+                    if workers_enabled():
+                        # Inference di worker process (INFERENCE_WORKERS > 0): tanpa hasil parsial per tile
+                        enhanced_image = get_worker_pool().enhance(input_image, scale, enhance_mode)
+                    else:
+                        for kind, image in run_enhance_stream(input_image, scale, enhance_mode):
+                            if kind == 'partial':
+                                emit((image, None, {'status': 'partial'}))
+                            else:
+                                enhanced_image = image
+            except (QueueFullError, MemoryBudgetError, WorkerCrashedError) as error:
+                raise gr.Error(str(error))
+
+            # Encode file hasil di background; preview langsung dikembalikan, cache diisi setelah file selesai ditulis
+            with span('encode_submit'):
+                enhanced_path = output_store.save(
+                    enhanced_image, on_saved=lambda path: result_cache.put(key, [enhanced_image], files=[path])
+                )
+
+    # Return: image untuk preview, path file (siap setelah wait_for_output) & breakdown waktu per stage
+    return enhanced_image, enhanced_path, breakdown(trace)
+
+# Proses enhance sebenarnya (GFPGAN / Real-ESRGAN)
+@spaces.GPU(duration=15)
+def run_enhance(
+    input_image: Image,
+    scale: int,
+    enhance_mode: str,
+):
+    return _run_enhance(input_image, scale, enhance_mode)
+
+# Versi streaming: yield ('partial', preview) setiap kelompok tile selesai (di-throttle), lalu ('result', gambar)
+@spaces.GPU(duration=15)
+def run_enhance_stream(
+    input_image: Image,
+    scale: int,
+    enhance_mode: str,
+):
+    throttle = Throttle()
+    base = quick_preview(input_image)
+
+    def work(emit):
+        def on_tile(done, total, render):
+            # Render preview hanya jika throttle mengizinkan (tile terakhir langsung jadi hasil akhir)
+            if done < total and throttle.ready():
+                with span('partial_preview', tiles=done, total=total):
+                    emit(('partial', compose_preview(base, *render(PREVIEW_MAX_SIZE))))
+        return 'result', _run_enhance(input_image, scale, enhance_mode, tile_callback=on_tile)
+
+    yield from stream_call(work)
+
+def _run_enhance(
+    input_image: Image,
+    scale: int,
+    enhance_mode: str,
+    tile_callback=None,      # Opsional: callback per kelompok tile (preview bertahap)
 ):
     only_face = enhance_mode == "Only Face Enhance"
     
     # Pilih mode enhancer: hanya wajah, hanya gambar, atau kombinasi
+    # (GFPGANer diambil dari registry, jadi bobot model tidak di-load ulang setiap klik)
     if enhance_mode == "Only Face Enhance":
-        face_enhancer = GFPGANer(
-            model_path='GFPGANv1.4.pth', upscale=scale, 
-            arch='clean', channel_multiplier=2
-        )
+        face_enhancer = get_face_enhancer(scale, arch='clean')
     elif enhance_mode == "Only Image Enhance":
         face_enhancer = None  # Tidak enhance wajah, hanya upscaling gambar saja
     else:
-        face_enhancer = GFPGANer(
-            model_path='GFPGANv1.4.pth', upscale=scale, 
-            arch='clean', channel_multiplier=2, bg_upsampler=upsampler
-        )
+        face_enhancer = get_face_enhancer(scale, arch='clean', bg_upsampler=get_upsampler())
     
     # Konversi gambar input ke format BGR (OpenCV)
-    img = cv2.cvtColor(np.array(input_image), cv2.COLOR_RGB2BGR)
+    with span('decode', size=input_image.size):
+        img = np.array(input_image if input_image.mode == 'RGB' else input_image.convert('RGB'))
+        cv2.cvtColor(img, cv2.COLOR_RGB2BGR, dst=img)  # In-place, tanpa salinan full-frame kedua
+        image_key = hash_image(input_image) if face_enhancer is not None else None
     h, w = img.shape[0:2]
 
-    # Optional: perbesar gambar jika terlalu kecil (kurang dari 300px)
-    if h < 300:
-        img = cv2.resize(img, (w * 2, h * 2), interpolation=cv2.INTER_LANCZOS4)
+    # Rencanakan ukuran akhir dulu (termasuk batas 3480px), lalu resize input sekali saja:
+    # perbesar 2x jika gambar kecil, atau perkecil supaya model tidak menghasilkan piksel di atas batas
+    plan = plan_resolution(w, h, scale, enhance_mode)
+    if plan.needs_input_resize:
+        with span('pre_resize', size=(w, h), target=plan.resized_size):
+            interpolation = cv2.INTER_LANCZOS4 if plan.input_factor > 1 else cv2.INTER_AREA
+            img = cv2.resize(img, plan.resized_size, interpolation=interpolation)
     
     # Proses enhance gambar (tergantung mode)
-    if face_enhancer is not None:
-        # Enhance wajah (GFPGAN), output gambar hasil enhancement
-        _, _, output = face_enhancer.enhance(
-            img, has_aligned=False, only_center_face=only_face, paste_back=True
-        )
-    else:
-        # Hanya upscaling image (tanpa enhance wajah)
-        output, _ = upsampler.enhance(img, outscale=scale)
-
-    # --- Optional resize (tidak digunakan)
-    # if scale != 2:
-    #     interpolation = cv2.INTER_AREA if scale < 2 else cv2.INTER_LANCZOS4
-    #     h, w = img.shape[0:2]
-    #     output = cv2.resize(output, (int(w * scale / 2), int(h * scale / 2)), interpolation=interpolation)
-    
-    # Batasi hasil enhance agar tidak lebih dari 3480px (biar aman dan efisien)
-    h, w = output.shape[0:2]
-    max_size = 3480
-    if h > max_size:
-        w = int(w * max_size / h)
-        h = max_size
-    if w > max_size:
-        h = int(h * max_size / w)
-        w = max_size
-    
-    # Resize hasil akhir
-    output = cv2.resize(output, (w, h), interpolation=cv2.INTER_LANCZOS4)
+    model_name = 'realesr-general-x4v3' if face_enhancer is None else 'GFPGANv1.4'
+    start = time.perf_counter()
+    with span('inference', size=plan.resized_size, mode=enhance_mode, model=model_name) as attrs:
+        if face_enhancer is not None:
+            # Enhance wajah (GFPGAN), output gambar hasil enhancement
+            # (deteksi wajah di salinan kecil, di-cache per hash gambar asli untuk semua scale/mode)
+            _, _, output = enhance_faces(face_enhancer, img, image_key=image_key, only_center_face=only_face)
+        else:
+            # Hanya upscaling image (tanpa enhance wajah)
+            # (pakai salinan per request supaya aman dipanggil bersamaan & bisa di-batch)
+            upsampler = get_upsampler().for_request()
+            upsampler.tile_callback = tile_callback
+            output, _ = upsampler.enhance(img, outscale=plan.outscale)
+        # Laporan rencana resolusi ikut dicatat sebagai atribut span (terlihat di breakdown / TRACE_LOG)
+        report = plan.report(time.perf_counter() - start)
+        attrs.update(target=report['target_size'], saved_px=report['saved_pixels'],
+                     saved_ms=round(report['saved_seconds'] * 1000, 2))
+
+    # Resize akhir hanya jika output lebih besar dari target (tidak pernah diperbesar setelah inference)
+    if output.shape[1] > plan.target_size[0] or output.shape[0] > plan.target_size[1]:
+        with span('clamp_resize', size=(output.shape[1], output.shape[0]), target=plan.target_size):
+            output = cv2.resize(output, plan.target_size, interpolation=cv2.INTER_LANCZOS4)
 
     # Konversi kembali ke RGB & PIL Image (untuk output Gradio)
-    enhanced_image = Image.fromarray(cv2.cvtColor(output, cv2.COLOR_BGR2RGB))
+    with span('to_pil', size=plan.target_size):
+        cv2.cvtColor(output, cv2.COLOR_BGR2RGB, dst=output)  # In-place (output milik request ini)
+        enhanced_image = Image.fromarray(output)
     
-    # Simpan gambar hasil enhance ke folder output dengan nama unik
-    tmpPrefix = "/tmp/gradio/"
-    extension = 'png'
-    # targetDir = f"{tmpPrefix}output/"
-    targetDir = "output/"
-    if not os.path.exists(targetDir):
-        os.makedirs(targetDir)
-
-    enhanced_path = f"{targetDir}{uuid.uuid4()}.{extension}"
-    enhanced_image.save(enhanced_path, quality=100)
-        
-    return enhanced_image, enhanced_path  # Return: image untuk preview dan path file untuk download
+    return enhanced_image
 
 
 #
@@ -174,6 +223,8 @@ def create_demo() -> gr.Blocks:
                     gr.Markdown("<div class='card-title'><span style='font-size:1.3em;vertical-align:middle;'>🌈</span> <b>Hasil AI Enhance</b></div>")
                     output_image = gr.Image(label="", type="pil", interactive=False, elem_id="output-image", show_label=False)
                     enhance_image_path = gr.File(label="⬇️ Download (.png)", interactive=False, elem_id="download-btn")
+                    with gr.Accordion("⏱️ Detail Waktu Proses", open=False):
+                        timing = gr.JSON(label="", show_label=False)
                     gr.Markdown("""
                         <div class='hint' style="color:#ff914d;"><span style='font-size:1.2em;'>💡</span> Klik untuk download hasilnya!</div>
                     """)
@@ -201,10 +252,16 @@ def create_demo() -> gr.Blocks:
                 )
                 g_btn = gr.Button("🚀 Enhance Sekarang!", elem_id="enhance-btn", size="lg")
 
+        # Preview tampil segera, file download diisi setelah encoding background selesai
+        pending_path = gr.State()
         g_btn.click(
             fn=enhance_image,
             inputs=[input_image, scale, enhance_mode],
-            outputs=[output_image, enhance_image_path],
+            outputs=[output_image, pending_path, timing],
+        ).then(
+            fn=wait_for_output,
+            inputs=[pending_path],
+            outputs=[enhance_image_path],
         )
         # Footer dengan ikon & sentuhan branding
         # Tambahkan footer di bagian bawah
@@ -217,5 +274,4 @@ def create_demo() -> gr.Blocks:
     return demo
 
 
-
-
+record_startup('module:app_enhance', time.perf_counter() - _import_start)
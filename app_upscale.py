@@ -3,71 +3,170 @@ Image Upscaler App
 ------------------
 Aplikasi AI berbasis Gradio yang memanfaatkan Stable Diffusion Upscaler untuk meningkatkan resolusi gambar.
 Tersedia juga fitur segmentasi & restorasi area tertentu pada gambar (misal: wajah).
+Beberapa area/kategori (misal tiap wajah di foto grup, atau "face, hair") diproses dari satu segmentasi,
+di-upscale dalam satu batch, lalu ditempel kembali ke gambar asli sekaligus.
+Crop yang lebih besar dari SD_TILE_SIZE di-upscale per tile (overlap + blend) dengan budget memori.
+Hasil dikirim bertahap: preview interpolasi, hasil parsial per tile / batch region, lalu hasil akhir.
 Aplikasi mendukung input prompt teks untuk conditioning hasil upscaling.
 
 Created by _drat | 2025
 """
 
 # Import library eksternal yang diperlukan
+import os
 import requests
 from PIL import Image
 from io import BytesIO
-from diffusers import StableDiffusionUpscalePipeline # Pipeline Stable Diffusion untuk upscaling gambar
 import torch
 import gradio as gr
-import time
 import spaces
 
 # Import fungsi segmentasi dan restorasi (definisi di segment_utils.py)
 from segment_utils import(
-    segment_image,   # Untuk segmentasi area penting pada gambar (misal: wajah)
-    restore_result,  # Untuk menggabungkan hasil upscaling dengan gambar asli
+    parse_categories,  # Parsing daftar kategori ("face, hair")
+    segment_regions,   # Untuk segmentasi area penting pada gambar (misal: wajah), bisa lebih dari satu region
+    restore_regions,   # Untuk menggabungkan semua hasil upscaling dengan gambar asli
+)
+from cache_utils import make_key, result_cache  # Cache hasil berbasis hash piksel + parameter
+from output_utils import output_store, wait_for_output  # Encoder file hasil di background
+from trace_utils import breakdown, request_trace, span  # Span waktu per stage & metrik
+from stream_utils import PREVIEW_MAX_SIZE, Throttle, quick_preview, stream_call  # Preview bertahap
+from queue_utils import QueueFullError, get_queue  # Antrean per model dengan backpressure & lane prioritas
+from worker_utils import WorkerCrashedError  # Segmentasi di worker process (INFERENCE_WORKERS > 0) bisa gagal jika worker crash
+from pipeline_utils import (  # Profil eksekusi GPU (fp16) / CPU (fp32/bf16) & upscale berbasis tile
+    SD_TILE_SIZE,
+    ExecutionProfile,
+    load_upscale_pipeline,
+    tiled_upscale,
 )
 
 # Setup device: gunakan CUDA (GPU) jika tersedia, jika tidak fallback ke CPU
 device = "cuda" if torch.cuda.is_available() else "cpu"
 print(f'{device} is available')  # Debug: print device yang digunakan
 
-# Load model Stable Diffusion Upscaler dari HuggingFace
+# Load model Stable Diffusion Upscaler dari HuggingFace (dtype & optimasi mengikuti profil eksekusi device)
 model_id = "stabilityai/stable-diffusion-x4-upscaler"
-upscale_pipe = StableDiffusionUpscalePipeline.from_pretrained(model_id, torch_dtype=torch.float16)
-upscale_pipe = upscale_pipe.to(device)
+execution_profile = ExecutionProfile(device)
+upscale_pipe = load_upscale_pipeline(model_id, execution_profile)
 
-# Default prompt dan kategori (untuk input Gradio)
+# Default prompt dan kategori (untuk input Gradio); beberapa kategori dipisah koma, misal "face, hair"
 DEFAULT_SRC_PROMPT = "a person with pefect face"
 DEFAULT_CATEGORY = "face"
+# Jumlah maksimum crop region per panggilan pipeline (batch)
+UPSCALE_BATCH_SIZE = int(os.environ.get('UPSCALE_BATCH_SIZE', 4))
 
 # Fungsi utama untuk membuat UI aplikasi Gradio
 def create_demo() -> gr.Blocks:
 
     # --- [ Function Definitions Tetap Seperti Asli Anda ] ---
-    @spaces.GPU(duration=30)
-    def upscale_image(
-        input_image: Image,
+    # Upscale semua crop region dalam batch (ukuran crop sama: generate_size x generate_size);
+    # crop di atas SD_TILE_SIZE diproses per tile dengan progress per tile.
+    # Yield ('partial', daftar gambar sementara) per tile / batch selesai (di-throttle), lalu ('result', daftar gambar)
+    @spaces.GPU(duration=60)
+    def upscale_images_stream(
+        input_images: list,
         prompt: str,
         num_inference_steps: int = 10,
+        progress=None,
+    ):
+        throttle = Throttle()
+
+        def work(emit):
+            upscaled_images = []
+            if SD_TILE_SIZE > 0 and max(input_images[0].size) > SD_TILE_SIZE:
+                for index, image in enumerate(input_images):
+                    def report(done, total, index=index):
+                        if progress is not None:
+                            progress((index + done / total) / len(input_images), desc=f'Region {index + 1}/{len(input_images)} - tile {done}/{total}')
+
+                    def on_partial(render):
+                        if throttle.ready():
+                            emit(('partial', upscaled_images + [render(PREVIEW_MAX_SIZE)]))
+
+                    with span('inference', size=image.size, tiled=True, model=model_id, steps=int(num_inference_steps)):
+                        upscaled_images.append(tiled_upscale(
+                            upscale_pipe, image, prompt, num_inference_steps, progress=report, on_partial=on_partial
+                        ))
+                return 'result', upscaled_images
+
+            for start in range(0, len(input_images), UPSCALE_BATCH_SIZE):
+                batch = input_images[start:start + UPSCALE_BATCH_SIZE]
+                with span('inference', size=batch[0].size, batch=len(batch), model=model_id, steps=int(num_inference_steps)):
+                    upscaled_images.extend(upscale_pipe(
+                        prompt=[prompt] * len(batch),
+                        image=batch,
+                        num_inference_steps=num_inference_steps,
+                    ).images)
+                if len(upscaled_images) < len(input_images) and throttle.ready():
+                    emit(('partial', list(upscaled_images)))
+            return 'result', upscaled_images
+
+        yield from stream_call(work)
+
+    # Rantai segment_regions -> upscale_images_stream -> restore_regions dengan cache hasil
+    # (key: piksel input + prompt, steps, kategori & pengaturan mask), berbasis generator:
+    # preview interpolasi + crop region langsung dikirim, lalu hasil parsial upscale, lalu hasil akhir
+    def upscale_pipeline(
+        input_image: Image,
+        prompt: str,
+        num_inference_steps: int,
+        category: str,
+        generate_size: int,
+        mask_expansion: int,
+        mask_dilation: int,
+        progress=gr.Progress(),
     ):
-        time_cost_str = ''
-        run_task_time = 0
-        run_task_time, time_cost_str = get_time_cost(run_task_time, time_cost_str)
-        upscaled_image = upscale_pipe(
-            prompt=prompt, 
-            image=input_image,
-            num_inference_steps=num_inference_steps,
-        ).images[0]
-        run_task_time, time_cost_str = get_time_cost(run_task_time, time_cost_str)
-        return upscaled_image, time_cost_str
-
-    def get_time_cost(run_task_time, time_cost_str):
-        now_time = int(time.time()*1000)
-        if run_task_time == 0:
-            time_cost_str = 'start'
-        else:
-            if time_cost_str != '': 
-                time_cost_str += f'-->'
-            time_cost_str += f'{now_time - run_task_time}'
-        run_task_time = now_time
-        return run_task_time, time_cost_str
+        # Seluruh request berjalan di satu thread pekerja (trace tetap utuh), generator ini hanya meneruskan hasilnya
+        yield from stream_call(
+            _upscale_request, input_image, prompt, num_inference_steps, category,
+            generate_size, mask_expansion, mask_dilation, progress,
+        )
+
+    # Satu request upscale; emit((crop, upscaled, info, restored, path)) untuk setiap preview
+    def _upscale_request(
+        emit, input_image, prompt, num_inference_steps, category, generate_size, mask_expansion, mask_dilation, progress,
+    ):
+        categories = parse_categories(category)
+        with request_trace('upscale', size=input_image.size, category=categories, steps=int(num_inference_steps)) as trace:
+            with span('cache_lookup') as attrs:
+                key = make_key(
+                    'upscale', input_image, prompt=prompt, steps=int(num_inference_steps), categories=categories,
+                    generate_size=int(generate_size), mask_expansion=int(mask_expansion), mask_dilation=int(mask_dilation),
+                )
+                cached = result_cache.get(key)
+                attrs['hit'] = cached is not None
+
+            if cached is not None:
+                images, meta, paths = cached
+                count = meta['regions']
+                origin_areas, upscaled, restored = images[:count], images[count:2 * count], images[-1]
+                path = paths[-1]
+            else:
+                preview = quick_preview(input_image)
+                emit((None, None, {'status': 'preview'}, preview, None))
+                # Antrean model SD upscaler: lane dipilih dari total piksel crop (yang benar-benar di-upscale),
+                # antrean penuh langsung ditolak dengan pesan "sibuk"; worker segmentasi yang crash juga jadi pesan error
+                upscaled = None
+                try:
+                    origin_areas, regions = segment_regions(input_image, categories, generate_size, mask_expansion, mask_dilation)
+                    emit((origin_areas, None, {'status': 'segmented', 'regions': len(regions)}, preview, None))
+
+                    with get_queue('sd_upscale').slot(pixels=sum(area.width * area.height for area in origin_areas)):
+                        for kind, images in upscale_images_stream(origin_areas, prompt, num_inference_steps, progress):
+                            if kind == 'partial':
+                                emit((origin_areas, images, {'status': 'partial', 'done': len(images)}, preview, None))
+                            else:
+                                upscaled = images
+                except (QueueFullError, WorkerCrashedError) as error:
+                    raise gr.Error(str(error))
+                restored, path = restore_regions(input_image, regions, upscaled)
+                # Cache diisi di thread encoder setelah file hasil selesai ditulis (tidak memblokir request)
+                count = len(regions)
+                output_store.when_saved(path, lambda saved_path: result_cache.put(
+                    key, origin_areas + upscaled + [restored], meta={'regions': count},
+                    files=[None] * (2 * count) + [saved_path],
+                ))
+        return origin_areas, upscaled, breakdown(trace), restored, path
 
     # --- [ UI Section ] ---
     with gr.Blocks(css="creative_enhance.css") as demo:
@@ -111,31 +210,28 @@ def create_demo() -> gr.Blocks:
                 with gr.Group(elem_id="output-card"):
                     gr.Markdown("<div class='card-title'><span style='font-size:1.2em;'>💡</span> Upscale Preview</div>")
                     restored_image = gr.Image(label="Hasil Akhir", format="png", type="pil", interactive=False)
-                    origin_area_image = gr.Image(label="", format="png", type="pil", interactive=False, visible=False)
-                    upscaled_image = gr.Image(label="Upscaled", format="png", type="pil", interactive=False)
+                    origin_area_image = gr.Gallery(label="", format="png", type="pil", interactive=False, visible=False)
+                    upscaled_image = gr.Gallery(label="Upscaled", format="png", type="pil", interactive=False)
                     download_path = gr.File(label="⬇️ Download Image", interactive=False, elem_id="download-btn")
                     gr.Markdown("<div class='hint'><span style='font-size:1.1em;'>💾</span> Download hasil upscale PNG</div>")
-                    generated_cost = gr.Textbox(label="⏱️ Time (ms)", visible=True, interactive=False)
+                    generated_cost = gr.JSON(label="⏱️ Time (ms)", visible=True)
 
         # Hidden inputs untuk workflow
         category = gr.Textbox(label="Category", value=DEFAULT_CATEGORY, visible=False)
         mask_expansion = gr.Number(label="Mask Expansion", value=20, visible=False)
         mask_dilation = gr.Slider(minimum=0, maximum=10, value=2, step=1, label="Mask Dilation", visible=False)
-        croper = gr.State()
 
-        # Workflow chaining
+        pending_path = gr.State()
+
+        # Workflow: segment -> upscale -> restore (dibungkus cache hasil), lalu tunggu file download selesai di-encode
         g_btn.click(
-            fn=segment_image,
-            inputs=[input_image, category, generate_size, mask_expansion, mask_dilation],
-            outputs=[origin_area_image, croper],
-        ).success(
-            fn=upscale_image,
-            inputs=[origin_area_image, input_image_prompt, num_inference_steps],
-            outputs=[upscaled_image, generated_cost],
-        ).success(
-            fn=restore_result,
-            inputs=[croper, category, upscaled_image],
-            outputs=[restored_image, download_path],
+            fn=upscale_pipeline,
+            inputs=[input_image, input_image_prompt, num_inference_steps, category, generate_size, mask_expansion, mask_dilation],
+            outputs=[origin_area_image, upscaled_image, generated_cost, restored_image, pending_path],
+        ).then(
+            fn=wait_for_output,
+            inputs=[pending_path],
+            outputs=[download_path],
         )
 
         gr.Markdown("""
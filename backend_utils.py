@@ -0,0 +1,181 @@
+"""
+Backend Utils
+-------------
+Backend inference yang bisa dipilih untuk SRVGGNetCompact (realesr-general-x4v3), dipasang sebagai upsampler.model:
+- eager: PyTorch biasa (default, perilaku sebelumnya)
+- torchscript: graph hasil trace + freeze (overhead Python per layer hilang, fusi op di CPU)
+- onnx: sesi ONNX Runtime dari model yang di-export (axis batch/tinggi/lebar dinamis)
+- int8: model ONNX dengan kuantisasi dinamis int8 (bobot konvolusi 8-bit, aktivasi dikuantisasi saat jalan)
+- Cek paritas PSNR setiap backend terhadap eager, dengan ambang per backend
+
+Backend onnx & int8 butuh paket opsional onnxruntime (+ onnx untuk int8).
+
+Created by _drat | 2025
+"""
+
+import os
+import copy
+import math
+
+import torch
+
+# Backend yang dipakai upsampler bersama (eager / torchscript / onnx / int8)
+UPSCALE_BACKEND = os.environ.get('UPSCALE_BACKEND', 'eager')
+# Cek paritas saat backend dipasang; backend yang gagal (atau error saat dibangun) diganti eager
+BACKEND_PARITY_CHECK = os.environ.get('BACKEND_PARITY_CHECK', '1') == '1'
+# Folder cache file model hasil export (ONNX / ONNX int8)
+BACKEND_CACHE_DIR = os.environ.get('BACKEND_CACHE_DIR', 'checkpoints')
+# Ukuran input contoh untuk trace / export (axis tinggi & lebar tetap dinamis)
+EXAMPLE_SIZE = 64
+ONNX_OPSET = 17
+# Ambang PSNR minimum (dB) hasil backend terhadap eager
+PSNR_THRESHOLDS = {
+    'eager': math.inf,
+    'torchscript': 45.0,
+    'onnx': 45.0,
+    'int8': 30.0,
+}
+
+
+class EagerBackend:
+    name = 'eager'
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, tensor):
+        return self.model(tensor)
+
+
+class TorchScriptBackend:
+    name = 'torchscript'
+
+    # Trace dengan input contoh di device & dtype model; interpolate/pixel_shuffle tetap mengikuti ukuran input
+    def __init__(self, model):
+        parameter = next(model.parameters())
+        example = torch.rand(1, 3, EXAMPLE_SIZE, EXAMPLE_SIZE, device=parameter.device, dtype=parameter.dtype)
+        with torch.no_grad():
+            traced = torch.jit.trace(model.eval(), example)
+            self.model = torch.jit.freeze(traced)
+            if parameter.device.type == 'cpu':
+                self.model = torch.jit.optimize_for_inference(self.model)
+
+    def __call__(self, tensor):
+        return self.model(tensor)
+
+
+# Fungsi export model ke ONNX (float32, CPU); file dipakai ulang selama tidak lebih lama dari bobot model
+def export_onnx(model, path, source_path=None):
+    if os.path.exists(path) and (source_path is None or os.path.getmtime(path) >= os.path.getmtime(source_path)):
+        return path
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    model = copy.deepcopy(model).float().cpu().eval()
+    example = torch.rand(1, 3, EXAMPLE_SIZE, EXAMPLE_SIZE)
+    dynamic_axes = {'input': {0: 'batch', 2: 'height', 3: 'width'}, 'output': {0: 'batch', 2: 'height', 3: 'width'}}
+    tmp_path = f'{path}.tmp'
+    with torch.no_grad():
+        torch.onnx.export(
+            model, example, tmp_path, input_names=['input'], output_names=['output'],
+            dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET,
+        )
+    os.replace(tmp_path, path)
+    return path
+
+
+# Fungsi kuantisasi dinamis int8 model ONNX (bobot uint8: ConvInteger di CPU ONNX Runtime butuh bobot unsigned)
+def quantize_onnx(path, quantized_path):
+    if os.path.exists(quantized_path) and os.path.getmtime(quantized_path) >= os.path.getmtime(path):
+        return quantized_path
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp_path = f'{quantized_path}.tmp'
+    quantize_dynamic(path, tmp_path, weight_type=QuantType.QUInt8)
+    os.replace(tmp_path, quantized_path)
+    return quantized_path
+
+
+class OnnxBackend:
+    name = 'onnx'
+
+    def __init__(self, path):
+        try:
+            import onnxruntime as ort
+        except ImportError as error:
+            raise RuntimeError(f'Backend {self.name} butuh onnxruntime (pip install onnxruntime)') from error
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = [p for p in ('CUDAExecutionProvider', 'CPUExecutionProvider') if p in ort.get_available_providers()]
+        self.path = path
+        self.session = ort.InferenceSession(path, sess_options=options, providers=providers)
+
+    # Input/output tetap tensor torch (float32 di sesi ONNX, dikembalikan ke device & dtype input)
+    def __call__(self, tensor):
+        array = tensor.detach().float().cpu().numpy()
+        output = self.session.run(None, {'input': array})[0]
+        return torch.from_numpy(output).to(tensor.device, tensor.dtype)
+
+
+class Int8Backend(OnnxBackend):
+    name = 'int8'
+
+
+# Fungsi pembuat backend dari nama; model_path (bobot .pth) menentukan nama & kedaluwarsa file cache ONNX
+def build_backend(name, model, model_path=None, cache_dir=BACKEND_CACHE_DIR):
+    if name == 'eager':
+        return EagerBackend(model)
+    if name == 'torchscript':
+        return TorchScriptBackend(model)
+    if name in ('onnx', 'int8'):
+        stem = os.path.splitext(os.path.basename(model_path))[0] if model_path else f'srvgg-{id(model):x}'
+        onnx_path = export_onnx(model, os.path.join(cache_dir, f'{stem}.onnx'), model_path)
+        if name == 'onnx':
+            return OnnxBackend(onnx_path)
+        return Int8Backend(quantize_onnx(onnx_path, os.path.join(cache_dir, f'{stem}.int8.onnx')))
+    raise ValueError(f'Backend tidak dikenal: {name} (pilihan: {", ".join(PSNR_THRESHOLDS)})')
+
+
+# Fungsi PSNR (dB) dua tensor gambar di rentang [0, 1]
+def psnr(reference, output):
+    mse = float(((reference.float().clamp(0, 1) - output.float().clamp(0, 1)) ** 2).mean())
+    return math.inf if mse == 0 else 10 * math.log10(1.0 / mse)
+
+
+# Fungsi cek paritas backend vs eager pada gambar acak (ukuran berbeda dari ukuran trace/export)
+def check_backend_parity(backend, model, sizes=((96, 80), (160, 128)), threshold=None, seed=0):
+    threshold = PSNR_THRESHOLDS[backend.name] if threshold is None else threshold
+    parameter = next(model.parameters())
+    generator = torch.Generator().manual_seed(seed)
+    values = []
+    with torch.no_grad():
+        for width, height in sizes:
+            tensor = torch.rand(1, 3, height, width, generator=generator).to(parameter.device, parameter.dtype)
+            values.append(psnr(model(tensor), backend(tensor)))
+    worst = min(values)
+    return {
+        'backend': backend.name,
+        'psnr_db': [round(value, 2) for value in values],
+        'min_psnr_db': worst,
+        'threshold_db': threshold,
+        'ok': worst >= threshold,
+    }
+
+
+# Fungsi pemilih backend untuk upsampler bersama: bangun backend & cek paritas. Eager (dan fallback jika backend
+# gagal dibangun / di bawah ambang PSNR) mengembalikan model PyTorch aslinya, jadi perilakunya sama seperti sebelumnya
+def select_backend(name, model, model_path=None, parity_check=BACKEND_PARITY_CHECK):
+    if name == 'eager':
+        return model
+    try:
+        backend = build_backend(name, model, model_path)
+    except Exception as error:
+        print(f'[backend] {name} gagal dibangun ({type(error).__name__}: {error}), pakai eager')
+        return model
+    if parity_check:
+        report = check_backend_parity(backend, model)
+        print(f"[backend] {name}: PSNR min {report['min_psnr_db']:.2f} dB (ambang {report['threshold_db']:.0f} dB)")
+        if not report['ok']:
+            print(f'[backend] {name} di bawah ambang PSNR, pakai eager')
+            return model
+    return backend
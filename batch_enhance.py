@@ -0,0 +1,207 @@
+"""
+Batch Enhance CLI
+-----------------
+CLI tanpa UI untuk enhance banyak gambar sekaligus (misal: backfill malam hari):
+- Input dari folder (rekursif) atau file manifest (satu path per baris)
+- Diproses paralel dengan process pool, model di-load sekali per worker
+- Jumlah tugas "in flight" dibatasi supaya memori tetap terkendali
+- Progress dicatat ke manifest JSONL, jadi rerun otomatis melewati file yang sudah selesai
+- Statistik throughput ditampilkan di akhir
+
+Contoh:
+    python batch_enhance.py foto/ hasil/ --mode "Face Enhance + Image Enhance" --scale 2 --workers 4
+
+Created by _drat | 2025
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Ekstensi gambar yang diproses
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+# Mode enhance: mode app_enhance + mode sederhana enhance_utils
+APP_MODES = ("Only Face Enhance", "Only Image Enhance", "Face Enhance + Image Enhance")
+UTILS_MODES = ("face", "image")
+
+# Nama file manifest progress di folder output
+PROGRESS_FILE = 'progress.jsonl'
+
+
+# Fungsi untuk membaca daftar file input secara streaming (folder atau manifest).
+# exclude_dir (folder output) dilewati, supaya output di dalam folder sumber tidak ikut di-enhance ulang
+def iter_inputs(source, exclude_dir=None):
+    if os.path.isdir(source):
+        exclude = os.path.realpath(exclude_dir) if exclude_dir else None
+        for root, dirs, files in os.walk(source):
+            dirs[:] = sorted(d for d in dirs if os.path.realpath(os.path.join(root, d)) != exclude)
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(root, name)
+    else:
+        with open(source) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+
+
+# Fungsi untuk membaca daftar file yang sudah selesai dari manifest progress
+def load_progress(progress_path):
+    done = set()
+    if os.path.exists(progress_path):
+        with open(progress_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Baris terakhir bisa terpotong jika proses sebelumnya mati
+                if record.get('status') == 'ok':
+                    done.add(record['input'])
+    return done
+
+
+# Inisialisasi worker: atur jumlah thread torch & load model sekali per proses
+def _init_worker(mode, scale, threads):
+    import torch
+    from model_utils import get_face_enhancer, get_upsampler
+
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if mode in ("Only Image Enhance", "image"):
+        get_upsampler()
+    elif mode == "Only Face Enhance":
+        get_face_enhancer(scale)
+    elif mode == "face":
+        get_face_enhancer(1)
+    else:
+        get_face_enhancer(scale, bg_upsampler=get_upsampler())
+
+
+# Fungsi yang dijalankan di worker: baca -> enhance -> tulis, hanya metadata yang dikembalikan ke parent
+def _process_file(path, output_path, mode, scale, fmt):
+    from PIL import Image, ImageOps
+    from output_utils import encode_options
+
+    start = time.perf_counter()
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')  # Rotasi sesuai orientasi EXIF (foto kamera/HP)
+    if mode in UTILS_MODES:
+        from enhance_utils import enhance_image
+        result = enhance_image(image, enhance_face=(mode == "face"))
+    else:
+        from app_enhance import run_enhance
+        result = run_enhance(image, scale, mode)
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    tmp_path = f'{output_path}.tmp'
+    result.save(tmp_path, format=fmt.upper(), **encode_options(fmt))
+    os.replace(tmp_path, output_path)
+    return {
+        'input': path,
+        'output': output_path,
+        'status': 'ok',
+        'input_size': image.size,
+        'output_size': result.size,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+# Fungsi path output: struktur folder input dipertahankan, ekstensi mengikuti format
+def output_path_for(path, source, output_dir, fmt):
+    from output_utils import EXTENSIONS
+
+    if os.path.isdir(source):
+        relative = os.path.relpath(path, source)
+    else:
+        relative = os.path.basename(path)
+    return os.path.join(output_dir, f'{os.path.splitext(relative)[0]}.{EXTENSIONS[fmt]}')
+
+
+def run(args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    progress_path = os.path.join(args.output_dir, PROGRESS_FILE)
+    done = load_progress(progress_path)
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+    stats = {'ok': 0, 'failed': 0, 'skipped': 0, 'input_pixels': 0, 'output_pixels': 0, 'seconds': 0.0}
+    max_in_flight = args.workers * 2
+    start = time.perf_counter()
+
+    with open(progress_path, 'a') as progress, ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(args.mode, args.scale, threads),
+    ) as executor:
+        in_flight = {}
+
+        def collect(futures):
+            for future in futures:
+                path = in_flight.pop(future)
+                try:
+                    record = future.result()
+                    stats['ok'] += 1
+                    stats['input_pixels'] += record['input_size'][0] * record['input_size'][1]
+                    stats['output_pixels'] += record['output_size'][0] * record['output_size'][1]
+                    stats['seconds'] += record['seconds']
+                except Exception as e:
+                    record = {'input': path, 'status': 'failed', 'error': repr(e)}
+                    stats['failed'] += 1
+                progress.write(json.dumps(record) + '\n')
+                progress.flush()
+            processed = stats['ok'] + stats['failed']
+            if processed and processed % args.log_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f'[batch] {processed} selesai, {processed / elapsed:.2f} img/s', file=sys.stderr)
+
+        for path in iter_inputs(args.source, exclude_dir=args.output_dir):
+            if path in done:
+                stats['skipped'] += 1
+                continue
+            # Backpressure: tunggu sampai ada slot kosong sebelum submit file berikutnya
+            while len(in_flight) >= max_in_flight:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(finished)
+            output_path = output_path_for(path, args.source, args.output_dir, args.format)
+            future = executor.submit(_process_file, path, output_path, args.mode, args.scale, args.format)
+            in_flight[future] = path
+
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(finished)
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        'processed': stats['ok'],
+        'failed': stats['failed'],
+        'skipped': stats['skipped'],
+        'wall_seconds': round(elapsed, 3),
+        'images_per_second': round(stats['ok'] / elapsed, 3) if elapsed else 0.0,
+        'input_megapixels_per_second': round(stats['input_pixels'] / 1e6 / elapsed, 3) if elapsed else 0.0,
+        'output_megapixels_per_second': round(stats['output_pixels'] / 1e6 / elapsed, 3) if elapsed else 0.0,
+        'mean_seconds_per_image': round(stats['seconds'] / stats['ok'], 3) if stats['ok'] else 0.0,
+        'workers': args.workers,
+    }
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Batch enhance gambar dari folder atau manifest')
+    parser.add_argument('source', help='Folder gambar input atau file manifest (satu path per baris)')
+    parser.add_argument('output_dir', help='Folder output (juga tempat manifest progress)')
+    parser.add_argument('--mode', default="Face Enhance + Image Enhance", choices=APP_MODES + UTILS_MODES)
+    parser.add_argument('--scale', type=int, default=2, choices=[1, 2, 3, 4])
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 4))
+    parser.add_argument('--threads', type=int, default=0, help='Thread torch per worker (0 = otomatis)')
+    parser.add_argument('--format', default='png', choices=['png', 'webp', 'jpeg'])
+    parser.add_argument('--log-every', type=int, default=50)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    run(parse_args())
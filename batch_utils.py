@@ -0,0 +1,127 @@
+"""
+Batch Utils
+-----------
+Scheduler micro-batching untuk model SRVGGNetCompact yang dipakai bersama:
+- Mengumpulkan request (atau tile) berukuran sama dari beberapa caller dalam jendela waktu singkat
+- Menjalankannya sebagai satu tensor batch, lalu mengembalikan hasil ke Future masing-masing caller
+- Ukuran batch & waktu tunggu bisa dikonfigurasi, occupancy per batch dicatat untuk tuning
+
+Created by _drat | 2025
+"""
+
+import os
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import torch
+
+from trace_utils import metrics
+
+# Konfigurasi default (bisa dioverride lewat environment variable)
+BATCH_ENABLED = os.environ.get('BATCH_ENABLED', '0') == '1'
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 4))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 10))
+
+
+class BatchScheduler:
+    def __init__(
+        self,
+        model: torch.nn.Module,                 # Model bersama (sudah di device & dtype yang benar)
+        max_batch_size: int = BATCH_MAX_SIZE,   # Jumlah tensor maksimum per batch
+        max_wait_ms: float = BATCH_MAX_WAIT_MS, # Waktu tunggu maksimum untuk mengisi batch
+        history: int = 1000,                    # Jumlah batch terakhir yang disimpan untuk statistik
+    ):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._carry = deque()  # Request yang bentuknya tidak cocok dengan batch sebelumnya
+        self._occupancy = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self.total_batches = 0
+        self.total_items = 0
+        self._worker = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+        self._worker.start()
+
+    # Kirim satu tensor (1xCxHxW) ke scheduler, hasilnya diambil dari Future
+    def submit(self, tensor: torch.Tensor) -> Future:
+        future = Future()
+        self._queue.put((tensor, future))
+        return future
+
+    # Ambil request berikutnya (utamakan sisa dari batch sebelumnya)
+    def _next(self, timeout=None):
+        if self._carry:
+            return self._carry.popleft()
+        return self._queue.get(timeout=timeout)
+
+    # Kumpulkan satu batch: request pertama menentukan bentuk tensor, sisanya harus sama bentuknya
+    def _collect(self):
+        first = self._next()
+        key = (tuple(first[0].shape[1:]), first[0].dtype)
+        batch = [first]
+        skipped = []
+        deadline = time.monotonic() + self.max_wait_ms / 1000.
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and not self._carry:
+                break
+            try:
+                item = self._next(timeout=max(0., remaining))
+            except queue.Empty:
+                break
+            if (tuple(item[0].shape[1:]), item[0].dtype) == key:
+                batch.append(item)
+            else:
+                skipped.append(item)
+        self._carry.extend(skipped)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            tensors = [tensor for tensor, _ in batch]
+            try:
+                with torch.no_grad():
+                    output = self.model(torch.cat(tensors, dim=0))
+                outputs = torch.split(output, [t.shape[0] for t in tensors], dim=0)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, outputs):
+                future.set_result(result)
+            with self._lock:
+                self.total_batches += 1
+                self.total_items += len(batch)
+                self._occupancy.append(len(batch))
+
+    # Statistik occupancy batch (rata-rata & histogram ukuran batch terakhir)
+    def stats(self):
+        with self._lock:
+            occupancy = list(self._occupancy)
+            histogram = {}
+            for size in occupancy:
+                histogram[size] = histogram.get(size, 0) + 1
+            mean_size = sum(occupancy) / len(occupancy) if occupancy else 0.0
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'batches': self.total_batches,
+                'items': self.total_items,
+                'mean_batch_size': mean_size,
+                'mean_occupancy': mean_size / self.max_batch_size,
+                'histogram': histogram,
+                'queue_depth': self._queue.qsize() + len(self._carry),
+            }
+
+
+# Fungsi untuk memasang scheduler micro-batching pada upsampler (TiledRealESRGANer);
+# occupancy & histogram ukuran batch diekspor di endpoint metrik (komponen "batch_scheduler")
+def enable_batching(upsampler, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+    upsampler.batch_scheduler = BatchScheduler(upsampler.model, max_batch_size, max_wait_ms)
+    metrics.register_stats('batch_scheduler', upsampler.batch_scheduler.stats)
+    return upsampler.batch_scheduler
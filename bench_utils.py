@@ -0,0 +1,344 @@
+"""
+Bench Utils
+-----------
+Utilitas benchmark offline (CPU, tanpa download bobot model):
+- Model stand-in kecil yang diinisialisasi acak: SRVGGNetCompact, GFPGAN (+ face helper dengan deteksi sintetis),
+  segmenter MediaPipe, dan StableDiffusionUpscalePipeline mini (UNet/VAE/CLIP kecil, tokenizer dibuat lokal)
+- Pembuat gambar sintetis untuk berbagai ukuran
+- Helper pengukur waktu per stage & penyimpanan/pembanding hasil JSON
+
+Created by _drat | 2025
+"""
+
+import os
+import json
+import time
+import platform
+import tempfile
+import statistics
+import tracemalloc
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+# Matriks ukuran gambar default (lebar, tinggi)
+DEFAULT_SIZES = [(256, 256), (640, 480), (1280, 960), (2048, 1536)]
+
+
+# Fungsi pembuat gambar sintetis (gradien + noise, supaya encoder PNG tidak terlalu "mudah")
+def random_image(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    base = np.stack([xx * 255 // max(1, width - 1), yy * 255 // max(1, height - 1), (xx + yy) % 256], axis=-1)
+    noise = rng.integers(0, 32, size=(height, width, 3))
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+
+# Fungsi pengukur waktu satu stage (ms): mean, min, p50
+def time_stage(fn, repeat=3, warmup=1):
+    for _ in range(warmup):
+        result = fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        'mean_ms': statistics.mean(samples),
+        'min_ms': min(samples),
+        'p50_ms': statistics.median(samples),
+        'repeat': repeat,
+    }, result
+
+
+# Fungsi pengukur peak memori (byte, alokasi Python/numpy lewat tracemalloc) satu pemanggilan
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+# Fungsi metadata lingkungan benchmark (untuk membandingkan antar run)
+def environment():
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+        'machine': platform.machine(),
+    }
+
+
+# Fungsi simpan hasil benchmark ke JSON
+def save_results(path, results):
+    with open(path, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+
+
+# Fungsi pembanding dua run: kembalikan daftar stage yang melambat melebihi threshold
+def compare_results(baseline_path, results, threshold=0.2):
+    with open(baseline_path) as f:
+        baseline = {
+            (r['suite'], r['case'], r['size'], r['stage']): r for r in json.load(f)['results']
+        }
+    regressions = []
+    for r in results:
+        old = baseline.get((r['suite'], r['case'], r['size'], r['stage']))
+        if old is None or old['p50_ms'] <= 0:
+            continue
+        ratio = r['p50_ms'] / old['p50_ms']
+        if ratio > 1 + threshold:
+            regressions.append({**r, 'baseline_p50_ms': old['p50_ms'], 'ratio': ratio})
+    return regressions
+
+
+# Fungsi pembuat upsampler stand-in: SRVGGNetCompact kecil dengan bobot acak (disimpan ke file sementara)
+def make_standin_upsampler(num_feat=16, num_conv=4, seed=0, **kwargs):
+    from basicsr.archs.srvgg_arch import SRVGGNetCompact
+    from tile_utils import TiledRealESRGANer
+
+    torch.manual_seed(seed)
+    model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=num_feat, num_conv=num_conv, upscale=4, act_type='prelu')
+    weights = os.path.join(tempfile.mkdtemp(prefix='bench-'), 'standin-srvgg.pth')
+    torch.save({'params': model.state_dict()}, weights)
+    kwargs.setdefault('half', False)
+    return TiledRealESRGANer(scale=4, model_path=weights, model=model, tile=0, tile_pad=10, pre_pad=0, **kwargs)
+
+
+# Landmark 5 titik template facexlib untuk wajah 512x512 (mata kiri, mata kanan, hidung, sudut mulut kiri & kanan)
+FACE_TEMPLATE_512 = np.array([
+    [192.98138, 239.94708], [318.90277, 240.1936], [256.63416, 314.01935], [201.26117, 371.41043], [313.08905, 371.15118],
+], dtype=np.float32)
+
+
+class StandInFaceDetector:
+    # Pengganti RetinaFace: wajah sintetis di posisi relatif tetap (cx, cy, sisi relatif terhadap sisi terpendek),
+    # format output sama seperti detect_faces facexlib: [x1, y1, x2, y2, score, 5 landmark (x, y)]
+    def __init__(self, faces=((0.5, 0.45, 0.4), (0.2, 0.3, 0.2))):
+        self.faces = faces
+
+    def detect_faces(self, img, conf_threshold=0.8):
+        h, w = img.shape[:2]
+        bboxes = []
+        for cx, cy, size in self.faces:
+            side = size * min(h, w)
+            x0, y0 = cx * w - side / 2, cy * h - side / 2
+            landmarks = FACE_TEMPLATE_512 / 512 * side + [x0, y0]
+            bboxes.append([x0, y0, x0 + side, y0 + side, 0.99, *landmarks.ravel()])
+        bboxes = [bbox for bbox in bboxes if bbox[4] >= conf_threshold]
+        return np.asarray(bboxes, dtype=np.float32).reshape(-1, 15)
+
+
+class StandInFaceHelper:
+    # Pengganti FaceRestoreHelper (facexlib): deteksi, align (affine ke template), inverse affine & paste back
+    # dengan atribut & method yang sama, tanpa download bobot deteksi/parsing
+    def __init__(self, upscale_factor=2, face_size=512):
+        self.upscale_factor = upscale_factor
+        self.face_size = face_size
+        self.face_template = FACE_TEMPLATE_512 * (face_size / 512)
+        self.template_3points = False
+        self.face_det = StandInFaceDetector()
+        self.clean_all()
+
+    def clean_all(self):
+        self.input_img = None
+        self.all_landmarks_5 = []
+        self.det_faces = []
+        self.affine_matrices = []
+        self.inverse_affine_matrices = []
+        self.cropped_faces = []
+        self.restored_faces = []
+
+    def read_image(self, img):
+        self.input_img = img[:, :, :3] if img.ndim == 3 else cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+    # Deteksi di resolusi penuh seperti FaceRestoreHelper.get_face_landmarks_5
+    def get_face_landmarks_5(self, only_center_face=False, eye_dist_threshold=5):
+        from face_utils import apply_detections, detect_faces_normalized
+
+        detections = detect_faces_normalized(self.face_det, self.input_img, detect_size=0)
+        return apply_detections(self, detections, only_center_face, eye_dist_threshold)
+
+    def align_warp_face(self):
+        for landmark in self.all_landmarks_5:
+            affine_matrix = cv2.estimateAffinePartial2D(landmark, self.face_template, method=cv2.LMEDS)[0]
+            self.affine_matrices.append(affine_matrix)
+            self.cropped_faces.append(cv2.warpAffine(
+                self.input_img, affine_matrix, (self.face_size, self.face_size),
+                borderMode=cv2.BORDER_CONSTANT, borderValue=(135, 133, 132),
+            ))
+
+    def add_restored_face(self, face):
+        self.restored_faces.append(face)
+
+    def get_inverse_affine(self, save_inverse_affine_path=None):
+        for affine_matrix in self.affine_matrices:
+            self.inverse_affine_matrices.append(cv2.invertAffineTransform(affine_matrix) * self.upscale_factor)
+
+    # Tempel wajah ke gambar (background hasil upsampler, atau input di-resize): mask affine yang di-erode & di-blur
+    def paste_faces_to_input_image(self, save_path=None, upsample_img=None):
+        h, w = self.input_img.shape[:2]
+        h_up, w_up = int(h * self.upscale_factor), int(w * self.upscale_factor)
+        background = self.input_img if upsample_img is None else upsample_img
+        output = cv2.resize(background, (w_up, h_up), interpolation=cv2.INTER_LANCZOS4).astype(np.float32)
+        kernel = np.ones((2 * self.upscale_factor + 1, 2 * self.upscale_factor + 1), np.uint8)
+        for restored_face, inverse_affine in zip(self.restored_faces, self.inverse_affine_matrices):
+            inv_restored = cv2.warpAffine(restored_face, inverse_affine, (w_up, h_up)).astype(np.float32)
+            mask = np.ones((self.face_size, self.face_size), dtype=np.float32)
+            inv_mask = cv2.erode(cv2.warpAffine(mask, inverse_affine, (w_up, h_up)), kernel)
+            inv_mask = cv2.GaussianBlur(inv_mask, (0, 0), max(1, self.upscale_factor))[:, :, None]
+            output = inv_mask * inv_restored + (1 - inv_mask) * output
+        return np.clip(output + 0.5, 0, 255).astype(np.uint8)
+
+
+class StandInGFPGAN(torch.nn.Module):
+    # Pengganti arsitektur GFPGAN: conv kecil acak, signature forward & output (image, out_rgbs) sama
+    def __init__(self):
+        super().__init__()
+        self.body = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 16, 3, padding=1), torch.nn.ReLU(), torch.nn.Conv2d(16, 3, 3, padding=1)
+        )
+
+    def forward(self, x, return_latents=False, return_rgb=True, weight=0.5, randomize_noise=True):
+        return torch.tanh(x + self.body(x)), []
+
+
+class StandInFaceEnhancer:
+    # Pengganti GFPGANer: face_helper stand-in (deteksi sintetis) + GFPGAN stand-in, jadi enhance_faces memakai
+    # jalur deteksi kecil, restorasi batch & background paralel yang sama seperti model aslinya
+    def __init__(self, upscale=2, bg_upsampler=None, face_size=512, seed=0):
+        torch.manual_seed(seed)
+        self.upscale = upscale
+        self.bg_upsampler = bg_upsampler
+        self.device = torch.device('cpu')
+        self.face_helper = StandInFaceHelper(upscale, face_size)
+        self.gfpgan = StandInGFPGAN().eval()
+
+    # Jalur berurutan seperti GFPGANer.enhance (deteksi resolusi penuh, restorasi per wajah, background setelahnya)
+    @torch.no_grad()
+    def enhance(self, img, has_aligned=False, only_center_face=False, paste_back=True):
+        from face_utils import restore_face, upsample_background
+
+        self.face_helper.clean_all()
+        self.face_helper.read_image(img)
+        self.face_helper.get_face_landmarks_5(only_center_face=only_center_face, eye_dist_threshold=5)
+        self.face_helper.align_warp_face()
+        for cropped_face in self.face_helper.cropped_faces:
+            self.face_helper.add_restored_face(restore_face(self, cropped_face, randomize_noise=False))
+
+        bg_img = None
+        if self.bg_upsampler is not None:
+            bg_img = upsample_background(self.bg_upsampler, img, self.upscale)[0]
+        self.face_helper.get_inverse_affine(None)
+        restored_img = self.face_helper.paste_faces_to_input_image(upsample_img=bg_img)
+        return self.face_helper.cropped_faces, self.face_helper.restored_faces, restored_img
+
+
+class _CategoryMask:
+    def __init__(self, mask):
+        self._mask = mask
+
+    def numpy_view(self):
+        return self._mask
+
+
+class _SegmentationResult:
+    def __init__(self, mask):
+        self.category_mask = _CategoryMask(mask)
+
+
+class StandInSegmenter:
+    # Pengganti ImageSegmenter MediaPipe: mask kategori sintetis (rambut, kulit tubuh, wajah, pakaian)
+    def segment(self, image):
+        data = image.numpy_view()
+        h, w = data.shape[:2]
+        yy, xx = np.ogrid[0:h, 0:w]
+        cy, cx, r = h * 0.4, w * 0.5, min(h, w) * 0.2
+        mask = np.zeros((h, w), dtype=np.uint8)
+        mask[int(h * 0.6):] = 4                                                  # pakaian
+        mask[(yy > h * 0.55) & (np.abs(xx - cx) < r * 0.4)] = 2                  # kulit tubuh (leher)
+        mask[((yy - (cy - r * 0.3)) ** 2 + (xx - cx) ** 2) < (r * 1.2) ** 2] = 1  # rambut
+        mask[((yy - cy) ** 2 + (xx - cx) ** 2) < r ** 2] = 3                     # wajah
+        return _SegmentationResult(mask)
+
+
+# Fungsi pembuat StableDiffusionUpscalePipeline mini yang diinisialisasi acak (tanpa download)
+def make_standin_upscale_pipeline(seed=0):
+    from diffusers import AutoencoderKL, DDIMScheduler, DDPMScheduler, StableDiffusionUpscalePipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+    from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+    torch.manual_seed(seed)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=7,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32,
+        attention_head_dim=8,
+        use_linear_projection=True,
+        only_cross_attention=(True, True, False),
+        num_class_embeds=100,
+    )
+    # VAE 3 blok = faktor 4x, sama seperti x4-upscaler
+    vae = AutoencoderKL(
+        block_out_channels=[32, 32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D"] * 3,
+        up_block_types=["UpDecoderBlock2D"] * 3,
+        latent_channels=4,
+    )
+
+    # Tokenizer CLIP byte-level tanpa merge (vocab ditulis ke folder sementara)
+    symbols = list(bytes_to_unicode().values())
+    tokens = symbols + [s + '</w>' for s in symbols] + ['<|startoftext|>', '<|endoftext|>']
+    folder = tempfile.mkdtemp(prefix='standin_tokenizer_')
+    with open(os.path.join(folder, 'vocab.json'), 'w') as f:
+        json.dump({token: i for i, token in enumerate(tokens)}, f)
+    with open(os.path.join(folder, 'merges.txt'), 'w') as f:
+        f.write('#version: 0.2\n')
+    tokenizer = CLIPTokenizer(os.path.join(folder, 'vocab.json'), os.path.join(folder, 'merges.txt'), pad_token='<|endoftext|>')
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        bos_token_id=len(tokens) - 2, eos_token_id=len(tokens) - 1, pad_token_id=len(tokens) - 1,
+        hidden_size=32, intermediate_size=37, num_attention_heads=4, num_hidden_layers=5,
+        vocab_size=len(tokens), max_position_embeddings=77,
+    ))
+
+    return StableDiffusionUpscalePipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        unet=unet,
+        low_res_scheduler=DDPMScheduler(),
+        scheduler=DDIMScheduler(prediction_type='v_prediction'),
+        max_noise_level=350,
+    )
+
+
+# Fungsi untuk memasang semua model stand-in ke provider (model_utils & segment_utils)
+def install_standin_models(scales=(1, 2, 3, 4)):
+    import model_utils
+    import segment_utils
+
+    upsampler = make_standin_upsampler()
+    model_utils.set_upsampler(upsampler)
+    registry = model_utils.face_enhancer_registry
+    registry.max_items = max(registry.max_items, 2 * len(scales))
+    for scale in scales:
+        for bg in (None, upsampler):
+            model_utils.face_enhancer_registry.get(
+                (scale, 'clean', bg), lambda scale=scale, bg=bg: StandInFaceEnhancer(scale, bg)
+            )
+    segment_utils.segmenter = StandInSegmenter()
+    return upsampler
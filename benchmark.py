@@ -0,0 +1,426 @@
+"""
+Benchmark
+---------
+Benchmark per stage untuk pipeline enhance / segment / restore, berjalan offline di CPU
+memakai model stand-in kecil yang diinisialisasi acak (lihat bench_utils.py).
+Hasil disimpan ke JSON dan bisa dibandingkan dengan run sebelumnya untuk mendeteksi regresi.
+
+Contoh:
+    python benchmark.py --suite stages --sizes 640x480,2048x1536 --output bench.json
+    python benchmark.py --suite stages --baseline bench.json --threshold 0.2
+    python benchmark.py --suite masks --sizes 2048x1536,6000x4000
+    python benchmark.py --suite sd_cpu --repeat 2
+    python benchmark.py --suite workers --sizes 640x480
+    python benchmark.py --suite backends --repeat 5
+    python benchmark.py --suite parity
+
+Created by _drat | 2025
+"""
+
+import io
+import sys
+import argparse
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from bench_utils import (
+    DEFAULT_SIZES,
+    StandInFaceEnhancer,
+    compare_results,
+    install_standin_models,
+    make_standin_upsampler,
+    make_standin_upscale_pipeline,
+    peak_memory,
+    random_image,
+    save_results,
+    time_stage,
+)
+
+# Ukuran foto besar (12, 24, 48 MP) untuk suite segmentasi
+LARGE_SIZES = [(4000, 3000), (6000, 4000), (8000, 6000)]
+# Ukuran crop input pipeline SD mini (output 4x)
+SD_SIZES = [(64, 64), (128, 128)]
+# Ukuran input suite "backends" (arsitektur realesr-general-x4v3 penuh, output 4x)
+BACKEND_SIZES = [(128, 128), (256, 256), (512, 384)]
+# Ukuran gambar suite "parity" (cukup besar untuk dipecah menjadi beberapa tile)
+PARITY_SIZES = [(256, 256), (640, 480)]
+# Kombinasi profil eksekusi CPU yang dibandingkan pada suite "sd_cpu"
+SD_CPU_PROFILES = [
+    {'dtype': 'float32', 'attention_slicing': False, 'channels_last': False},
+    {'dtype': 'float32', 'attention_slicing': True, 'channels_last': False},
+    {'dtype': 'float32', 'attention_slicing': True, 'channels_last': True},
+    {'dtype': 'bfloat16', 'attention_slicing': True, 'channels_last': True},
+    {'dtype': 'float32', 'attention_slicing': True, 'channels_last': True, 'compile': True},
+]
+
+
+# Suite "stages": tiap stage app_enhance.enhance_image, enhance_utils, segment_image, Croper & restore_result
+def suite_stages(sizes, repeat):
+    upsampler = install_standin_models()
+
+    import mediapipe as mp
+    import app_enhance
+    import enhance_utils
+    import segment_utils
+    from croper import Croper
+    from output_utils import encode_options
+    from resolution_utils import plan_resolution
+
+    results = []
+    for width, height in sizes:
+        image = random_image(width, height)
+
+        def record(case, stage, stats):
+            results.append({'suite': 'stages', 'case': case, 'size': f'{width}x{height}', 'stage': stage, **stats})
+
+        # --- Stage-stage app_enhance.run_enhance (mode "Only Image Enhance", scale 2)
+        stats, bgr = time_stage(lambda: cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR), repeat)
+        record('app_enhance', 'rgb2bgr', stats)
+
+        plan = plan_resolution(width, height, 2, "Only Image Enhance")
+        interpolation = cv2.INTER_LANCZOS4 if plan.input_factor > 1 else cv2.INTER_AREA
+        stats, resized = time_stage(
+            lambda: cv2.resize(bgr, plan.resized_size, interpolation=interpolation) if plan.needs_input_resize else bgr,
+            repeat,
+        )
+        record('app_enhance', 'pre_resize', stats)
+
+        stats, output = time_stage(lambda: upsampler.for_request().enhance(resized, outscale=plan.outscale)[0], repeat)
+        record('app_enhance', 'inference', stats)
+
+        stats, output = time_stage(
+            lambda: cv2.resize(output, plan.target_size, interpolation=cv2.INTER_LANCZOS4), repeat
+        )
+        record('app_enhance', 'clamp_resize', stats)
+
+        stats, enhanced = time_stage(lambda: Image.fromarray(cv2.cvtColor(output, cv2.COLOR_BGR2RGB)), repeat)
+        record('app_enhance', 'to_pil', stats)
+
+        stats, _ = time_stage(lambda: enhanced.save(io.BytesIO(), format='PNG', **encode_options('png')), repeat)
+        record('app_enhance', 'png_save', stats)
+
+        # --- End-to-end per mode
+        for mode in ("Only Face Enhance", "Only Image Enhance", "Face Enhance + Image Enhance"):
+            stats, _ = time_stage(lambda: app_enhance.run_enhance(image, 2, mode), repeat)
+            record('app_enhance', f'total[{mode}]', stats)
+        for enhance_face in (False, True):
+            stats, _ = time_stage(lambda: enhance_utils.enhance_image(image, enhance_face), repeat)
+            record('enhance_utils', f'total[face={enhance_face}]', stats)
+
+        # --- Segmentasi, crop & restore (cache segmentasi dikosongkan per panggilan: ukur MediaPipe, bukan cache hit)
+        def uncached(fn):
+            def run():
+                segment_utils.segmentation_cache.clear()
+                return fn()
+            return run
+
+        stats, (origin_area, croper) = time_stage(
+            uncached(lambda: segment_utils.segment_image(image, 'face', 512, 20, 2)), repeat
+        )
+        record('segment_utils', 'segment_image', stats)
+
+        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=np.asarray(image))
+        category_mask = segment_utils.get_segmenter().segment(mp_image).category_mask.numpy_view()
+        target_mask = segment_utils.get_face_mask(category_mask, 2)
+        stats, _ = time_stage(lambda: Croper(image, target_mask, 512, 20).corp_mask_image(), repeat)
+        record('croper', 'corp_mask_image', stats)
+
+        generated = origin_area.resize((2048, 2048))  # Ukuran keluaran SD x4 untuk generate_size 512
+        stats, _ = time_stage(lambda: segment_utils.restore_result(croper, 'face', generated), repeat)
+        record('segment_utils', 'restore_result', stats)
+
+        # --- Multi-region: satu segmentasi, beberapa kategori, restore sekaligus
+        stats, (origin_areas, regions) = time_stage(
+            uncached(lambda: segment_utils.segment_regions(image, ['face', 'hair', 'clothes'], 512, 20, 2)), repeat
+        )
+        record('segment_utils', f'segment_regions[{len(regions)}]', stats)
+
+        generated_list = [area.resize((2048, 2048)) for area in origin_areas]
+        stats, _ = time_stage(lambda: segment_utils.restore_regions(image, regions, generated_list), repeat)
+        record('segment_utils', f'restore_regions[{len(regions)}]', stats)
+
+    return results
+
+
+# Suite "segment": segmentasi resolusi penuh vs resolusi kerja rendah (latency & peak memori)
+def suite_segment(sizes, repeat, working_sizes=(0, 512, 1024)):
+    install_standin_models()
+
+    import segment_utils
+
+    results = []
+    for width, height in sizes:
+        image = random_image(width, height)
+        for working_size in working_sizes:
+            def run():
+                segment_utils.segmentation_cache.clear()  # Ukur segmentasi sebenarnya, bukan cache hit
+                return segment_utils.segment_image(image, 'face', 512, 20, 2, working_size=working_size)
+
+            stats, _ = time_stage(run, repeat)
+            peak, _ = peak_memory(run)
+            results.append({
+                'suite': 'segment', 'case': 'segment_image', 'size': f'{width}x{height}',
+                'stage': f'working_size={working_size or "full"}', 'peak_bytes': peak, **stats,
+            })
+    return results
+
+
+# Suite "sd_cpu": steps/detik StableDiffusionUpscalePipeline mini per profil eksekusi CPU
+def suite_sd_cpu(sizes, repeat, steps=5, profiles=SD_CPU_PROFILES):
+    from pipeline_utils import ExecutionProfile, configure_pipeline
+
+    results = []
+    for settings in profiles:
+        profile = ExecutionProfile('cpu', **settings)
+        pipe = configure_pipeline(make_standin_upscale_pipeline(), profile)
+        name = ','.join(f'{k}={v}' for k, v in profile.describe().items() if k != 'device')
+        for width, height in sizes:
+            image = random_image(width, height)
+            stats, _ = time_stage(lambda: pipe(prompt='a photo', image=image, num_inference_steps=steps).images[0], repeat)
+            results.append({
+                'suite': 'sd_cpu', 'case': 'sd_upscale', 'size': f'{width}x{height}', 'stage': name,
+                'steps_per_s': steps / (stats['mean_ms'] / 1000), **stats,
+            })
+    return results
+
+
+# Suite "sd_tiled": upscale SD mini full-frame vs per tile (latency, jumlah tile & estimasi memori per batch)
+def suite_sd_tiled(sizes, repeat, steps=3, tile_sizes=(0, 64, 128), memory_budget_mb=256):
+    from pipeline_utils import ExecutionProfile, SD_BYTES_PER_PIXEL, configure_pipeline, plan_tile_batch, tiled_upscale
+
+    pipe = configure_pipeline(make_standin_upscale_pipeline(), ExecutionProfile('cpu'))
+    results = []
+    for width, height in sizes:
+        image = random_image(width, height)
+        for tile_size in tile_sizes:
+            counter = {}
+            run = lambda: tiled_upscale(
+                pipe, image, 'a photo', steps, tile_size=tile_size, memory_budget_mb=memory_budget_mb,
+                progress=lambda done, total: counter.update(tiles=total),
+            )
+            stats, _ = time_stage(run, repeat)
+            tile = min(tile_size or max(width, height), width), min(tile_size or max(width, height), height)
+            batch = plan_tile_batch(*tile, memory_budget_mb) if tile_size else 1
+            results.append({
+                'suite': 'sd_tiled', 'case': 'sd_upscale', 'size': f'{width}x{height}',
+                'stage': f'tile={tile_size or "full"}', 'tiles': counter.get('tiles'), 'batch': batch,
+                'estimated_batch_bytes': batch * tile[0] * tile[1] * SD_BYTES_PER_PIXEL, **stats,
+            })
+    return results
+
+
+# Suite "workers": throughput enhance lewat worker process (shared memory) untuk beberapa jumlah worker
+def suite_workers(sizes, repeat, worker_counts=(1, 2, 4), mode="Only Image Enhance"):
+    from concurrent.futures import ThreadPoolExecutor
+    from worker_utils import WorkerPool
+
+    results = []
+    jobs = 2 * max(worker_counts)  # Jumlah gambar per putaran sama untuk semua jumlah worker
+    for count in worker_counts:
+        pool = WorkerPool(workers=count, initializer=install_standin_models)
+        try:
+            with ThreadPoolExecutor(max_workers=count) as executor:
+                for width, height in sizes:
+                    image = random_image(width, height)
+                    run = lambda: list(executor.map(lambda _: pool.enhance(image, 2, mode), range(jobs)))
+                    stats, _ = time_stage(run, repeat)  # Putaran warmup juga menunggu semua worker siap
+                    base = next((r for r in results if r['size'] == f'{width}x{height}' and r['workers'] == 1), None)
+                    images_per_s = jobs / (stats['mean_ms'] / 1000)
+                    results.append({
+                        'suite': 'workers', 'case': 'enhance', 'size': f'{width}x{height}', 'stage': f'workers={count}',
+                        'workers': count, 'images_per_s': images_per_s,
+                        'speedup': images_per_s / base['images_per_s'] if base else 1.0, **stats,
+                    })
+        finally:
+            pool.shutdown()
+    return results
+
+
+# Suite "backends": throughput forward SRVGGNetCompact per backend (eager / torchscript / onnx / int8)
+# & PSNR terhadap eager; backend di bawah ambang PSNR ditandai beda hasil
+def suite_backends(sizes, repeat, backends=('eager', 'torchscript', 'onnx', 'int8')):
+    import tempfile
+    import torch
+    from backend_utils import PSNR_THRESHOLDS, build_backend, psnr
+
+    # Arsitektur penuh realesr-general-x4v3 (bobot acak, tanpa download)
+    model = make_standin_upsampler(num_feat=64, num_conv=32).model
+    cache_dir = tempfile.mkdtemp(prefix='bench-backends-')
+    results = []
+    for name in backends:
+        try:
+            backend = build_backend(name, model, cache_dir=cache_dir)
+        except Exception as error:
+            print(f'[backends] {name} dilewati ({type(error).__name__}: {error})')
+            continue
+        for width, height in sizes:
+            tensor = torch.from_numpy(np.asarray(random_image(width, height))).permute(2, 0, 1)[None].float() / 255.
+            with torch.no_grad():
+                reference = model(tensor)
+                stats, output = time_stage(lambda: backend(tensor), repeat)
+            value = psnr(reference, output)
+            results.append({
+                'suite': 'backends', 'case': 'srvgg_forward', 'size': f'{width}x{height}', 'stage': f'backend={name}',
+                'megapixels_per_s': width * height / 1e6 / (stats['mean_ms'] / 1000),
+                'psnr_db': value, 'identical': value >= PSNR_THRESHOLDS[name], **stats,
+            })
+    return results
+
+
+# Suite "parity": hasil tile (feathering) vs full-frame Real-ESRGAN stand-in, dan jalur wajah (deteksi kecil,
+# restorasi batch, background paralel) vs jalur berurutan GFPGANer.enhance; selisih harus dalam toleransi
+def suite_parity(sizes, repeat, tile_sizes=(64, 128), tiled_budget_mb=16):
+    from face_utils import check_face_batch_parity, enhance_faces
+    from tile_utils import TILE_TOLERANCE
+
+    upsampler = make_standin_upsampler()
+    results = []
+    for width, height in sizes:
+        img = cv2.cvtColor(np.array(random_image(width, height)), cv2.COLOR_RGB2BGR)
+        common = {'suite': 'parity', 'size': f'{width}x{height}'}
+
+        # Tile eksplisit: forward full-frame vs blended_tile_process pada tensor yang sama
+        for tile_size in tile_sizes:
+            stats, report = time_stage(lambda: upsampler.for_request().check_tile_parity(img, tile_size), repeat)
+            results.append({
+                **common, 'case': 'tile', 'stage': f'tile={tile_size}', 'max_diff': report['max_diff'],
+                'mean_diff': report['mean_diff'], 'identical': report['ok'], **stats,
+            })
+
+        # Jalur enhance lengkap: budget memori kecil memaksa process() memakai tile
+        full_stats, full = time_stage(lambda: upsampler.for_request().enhance(img, outscale=2)[0], repeat)
+        tiled_upsampler = upsampler.for_request()
+        tiled_upsampler.memory_budget_mb = tiled_budget_mb
+        stats, tiled = time_stage(lambda: tiled_upsampler.for_request().enhance(img, outscale=2)[0], repeat)
+        max_diff = int(np.abs(full.astype(np.int16) - tiled.astype(np.int16)).max())
+        results.append({**common, 'case': 'enhance', 'stage': 'full', **full_stats})
+        results.append({
+            **common, 'case': 'enhance', 'stage': f'budget={tiled_budget_mb}MB', 'max_diff': max_diff,
+            'identical': max_diff <= TILE_TOLERANCE, **stats,
+        })
+
+        # Wajah: enhance_faces (deteksi di salinan 1/2, restorasi batch, background paralel) vs enhance() berurutan
+        # stand-in. Rata-rata selisih < 0.5 level: pembulatan landmark dari deteksi kecil boleh menggeser piksel tepi
+        face_enhancer = StandInFaceEnhancer(2, bg_upsampler=upsampler)
+        seq_stats, (_, _, sequential) = time_stage(lambda: face_enhancer.enhance(img), repeat)
+        stats, (cropped_faces, _, combined) = time_stage(
+            lambda: enhance_faces(face_enhancer, img, detect_size=max(width, height) // 2, parallel_bg=True), repeat
+        )
+        diff = np.abs(sequential.astype(np.int16) - combined.astype(np.int16))
+        results.append({**common, 'case': 'faces', 'stage': 'sequential', **seq_stats})
+        results.append({
+            **common, 'case': 'faces', 'stage': 'enhance_faces', 'faces': len(cropped_faces),
+            'max_diff': int(diff.max()), 'mean_diff': float(diff.mean()), 'identical': float(diff.mean()) < 0.5, **stats,
+        })
+
+        # Restorasi batch vs per wajah pada wajah hasil align yang sama
+        stats, report = time_stage(lambda: check_face_batch_parity(face_enhancer, cropped_faces), repeat)
+        results.append({
+            **common, 'case': 'faces', 'stage': f'batch={report["batch_size"]}', 'faces': report['faces'],
+            'max_diff': report['max_diff'], 'identical': report['ok'], **stats,
+        })
+    return results
+
+
+# Mask kategori sintetis: blob label 1-4 (ellipse) di atas background 0
+def synthetic_category_mask(width, height):
+    yy, xx = np.ogrid[0:height, 0:width]
+    category_mask = np.zeros((height, width), dtype=np.uint8)
+    for label, (cx, cy, rx, ry) in enumerate(
+        [(0.5, 0.2, 0.2, 0.15), (0.5, 0.8, 0.4, 0.25), (0.5, 0.35, 0.12, 0.15), (0.3, 0.7, 0.1, 0.3)], start=1
+    ):
+        inside = ((xx - cx * width) / (rx * width)) ** 2 + ((yy - cy * height) / (ry * height)) ** 2 <= 1
+        category_mask[inside] = label
+    return category_mask
+
+
+# Suite "masks": mesin morfologi (LUT + distance transform) vs binary_dilation iteratif, hasil harus identik
+def suite_masks(sizes, repeat, dilations=(0, 1, 4, 16, 32)):
+    from scipy.ndimage import binary_dilation
+    from mask_utils import category_target_mask
+
+    # Implementasi lama (dilasi iteratif) sebagai referensi
+    def reference(category_mask, category, dilation):
+        if category == 'clothes':
+            mask = binary_dilation(np.logical_or(category_mask == 2, category_mask == 4), iterations=4)
+        else:
+            mask = category_mask == {'hair': 1, 'face': 3}[category]
+        if dilation > 0:
+            mask = binary_dilation(mask, iterations=dilation)
+        return mask
+
+    results = []
+    for width, height in sizes:
+        category_mask = synthetic_category_mask(width, height)
+        for category in ('face', 'hair', 'clothes'):
+            for dilation in dilations:
+                ref_stats, expected = time_stage(lambda: reference(category_mask, category, dilation), repeat)
+                stats, actual = time_stage(lambda: category_target_mask(category_mask, category, dilation), repeat)
+                common = {'suite': 'masks', 'case': f'mask[{category}]', 'size': f'{width}x{height}'}
+                results.append({**common, 'stage': f'binary_dilation[{dilation}]', **ref_stats})
+                results.append({
+                    **common, 'stage': f'engine[{dilation}]', 'identical': bool(np.array_equal(expected, actual)),
+                    **stats,
+                })
+    return results
+
+
+# Daftar suite benchmark yang tersedia
+SUITES = {
+    'stages': suite_stages,
+    'segment': suite_segment,
+    'masks': suite_masks,
+    'sd_cpu': suite_sd_cpu,
+    'sd_tiled': suite_sd_tiled,
+    'workers': suite_workers,
+    'backends': suite_backends,
+    'parity': suite_parity,
+}
+
+
+def parse_sizes(value):
+    sizes = []
+    for item in value.split(','):
+        width, height = item.lower().split('x')
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark per stage (offline, model stand-in)')
+    parser.add_argument('--suite', default='stages', choices=sorted(SUITES))
+    parser.add_argument('--sizes', type=parse_sizes, default=None, help='Contoh: 640x480,2048x1536')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--baseline', default=None, help='File JSON run sebelumnya untuk deteksi regresi')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Batas perlambatan relatif (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or {
+        'segment': LARGE_SIZES, 'sd_cpu': SD_SIZES, 'sd_tiled': [(256, 256)], 'backends': BACKEND_SIZES,
+        'parity': PARITY_SIZES,
+    }.get(args.suite, DEFAULT_SIZES)
+    results = SUITES[args.suite](sizes, args.repeat)
+    save_results(args.output, results)
+    for r in results:
+        print(f"{r['case']:<16} {r['size']:>10} {r['stage']:<40} {r['p50_ms']:10.2f} ms")
+
+    mismatches = [r for r in results if r.get('identical') is False]
+    for r in mismatches:
+        print(f"BEDA HASIL {r['case']} {r['size']} {r['stage']}")
+    if mismatches:
+        return 1
+
+    if args.baseline:
+        regressions = compare_results(args.baseline, results, args.threshold)
+        for r in regressions:
+            print(f"REGRESI {r['case']} {r['size']} {r['stage']}: {r['baseline_p50_ms']:.2f} -> {r['p50_ms']:.2f} ms (x{r['ratio']:.2f})")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
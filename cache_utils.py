@@ -0,0 +1,238 @@
+"""
+Cache Utils
+-----------
+Cache hasil berbasis konten (content-addressed) untuk request enhance & upscale:
+- Key = hash piksel input (hasil decode) + semua parameter yang mempengaruhi output
+- Dua tier: LRU di memori (PIL Image) dan disk di bawah folder output/
+- Eviction berdasarkan ukuran (byte) di kedua tier, plus metrik hit-rate
+- ArrayCache: LRU memori untuk hasil antara (mask segmentasi, dll) yang di-key dengan hash gambar
+
+Created by _drat | 2025
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from trace_utils import metrics
+
+# Konfigurasi default (bisa dioverride lewat environment variable)
+CACHE_DIR = os.environ.get('CACHE_DIR', 'output/cache/')
+CACHE_MEMORY_MB = int(os.environ.get('CACHE_MEMORY_MB', 512))
+CACHE_DISK_MB = int(os.environ.get('CACHE_DISK_MB', 4096))
+
+
+# Fungsi hash piksel gambar (mode + ukuran + isi piksel)
+def hash_image(image: Image) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f'{image.mode}:{image.size}'.encode())
+    digest.update(np.ascontiguousarray(np.asarray(image)).data)
+    return digest.hexdigest()
+
+
+# Fungsi pembuat key cache dari gambar input + parameter
+def make_key(namespace: str, image: Image, **params) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(namespace.encode())
+    digest.update(hash_image(image).encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(
+        self,
+        cache_dir: str = CACHE_DIR,             # Folder tier disk
+        memory_mb: int = CACHE_MEMORY_MB,       # Batas ukuran tier memori
+        disk_mb: int = CACHE_DISK_MB,           # Batas ukuran tier disk
+    ):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_mb * 1024 * 1024
+        self.disk_bytes = disk_mb * 1024 * 1024
+        self._memory = OrderedDict()  # key -> (images, meta, paths, nbytes)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _meta_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    # Path file gambar cache; ekstensi mengikuti file sumber (OUTPUT_FORMAT png / webp / jpeg)
+    def _image_path(self, key, index, ext='.png'):
+        return os.path.join(self.cache_dir, f'{key}_{index}{ext}')
+
+    # Ambil hasil dari cache: (images, meta, paths) atau None
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                images, meta, paths, _ = self._memory[key]
+                if all(os.path.exists(p) for p in paths):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return images, meta, paths
+                del self._memory[key]  # File disk sudah di-evict, entry memori ikut dibuang
+
+            meta_path = self._meta_path(key)
+            if not os.path.exists(meta_path):
+                self.misses += 1
+                return None
+            try:
+                with open(meta_path) as f:
+                    record = json.load(f)
+                exts = record.get('exts', ['.png'] * record['count'])
+                paths = [self._image_path(key, i, ext) for i, ext in enumerate(exts)]
+                images = []
+                for path in paths:
+                    with Image.open(path) as image:
+                        images.append(image.copy())
+            except (OSError, ValueError, KeyError):
+                self.misses += 1
+                return None
+
+            # Tandai baru dipakai (untuk eviction disk) lalu promosikan ke tier memori
+            try:
+                for path in paths + [meta_path]:
+                    os.utime(path)
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store_memory(key, images, record['meta'], paths)
+            return images, record['meta'], paths
+
+    # Simpan hasil ke cache; files = path file yang sudah di-encode (di-link/copy, tidak encode ulang,
+    # ekstensinya dipertahankan supaya download dari cache hit tetap bernama sesuai formatnya)
+    def put(self, key, images, meta=None, files=None):
+        meta = meta or {}
+        paths = []
+        for index, image in enumerate(images):
+            source = files[index] if files and index < len(files) else None
+            if source and os.path.exists(source):
+                path = self._image_path(key, index, os.path.splitext(source)[1] or '.png')
+                try:
+                    os.link(source, path)
+                except OSError:
+                    shutil.copyfile(source, path)
+            else:
+                path = self._image_path(key, index)
+                image.save(path)
+            paths.append(path)
+        with open(self._meta_path(key), 'w') as f:
+            json.dump({'count': len(images), 'meta': meta, 'exts': [os.path.splitext(p)[1] for p in paths]}, f)
+
+        with self._lock:
+            self._store_memory(key, images, meta, paths)
+        self._evict_disk()
+        return paths
+
+    def _store_memory(self, key, images, meta, paths):
+        nbytes = sum(image.width * image.height * len(image.getbands()) for image in images)
+        self._memory[key] = (images, meta, paths, nbytes)
+        self._memory.move_to_end(key)
+        while len(self._memory) > 1 and sum(e[3] for e in self._memory.values()) > self.memory_bytes:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    # Eviction tier disk: buang entry dengan waktu akses terlama sampai di bawah batas ukuran.
+    # Dipanggil dari beberapa thread encoder sekaligus -> dijalankan di bawah lock cache (bergantian dengan get),
+    # file yang sudah hilang (dihapus thread lain / di luar proses) dilewati
+    def _evict_disk(self):
+        with self._lock:
+            entries = {}
+            for name in os.listdir(self.cache_dir):
+                key = name.split('_')[0].split('.')[0]
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                size, mtime = entries.get(key, (0, 0))
+                entries[key] = (size + stat.st_size, max(mtime, stat.st_mtime))
+
+            total = sum(size for size, _ in entries.values())
+            for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+                if total <= self.disk_bytes:
+                    break
+                for name in os.listdir(self.cache_dir):
+                    if name.startswith(key):
+                        try:
+                            os.remove(os.path.join(self.cache_dir, name))
+                        except FileNotFoundError:
+                            pass
+                self._memory.pop(key, None)
+                total -= size
+                self.evictions += 1
+
+    # Metrik cache (hit-rate per tier, ukuran tier)
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_items': len(self._memory),
+                'memory_bytes': sum(e[3] for e in self._memory.values()),
+                'evictions': self.evictions,
+            }
+
+
+class ArrayCache:
+    # LRU di memori untuk hasil antara berupa array numpy (mask segmentasi, deteksi wajah, dll)
+    def __init__(self, max_mb: int = 256, name: str = 'arrays'):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.name = name
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        metrics.register_stats(f'cache:{name}', self.stats)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, nbytes=None):
+        if nbytes is None:
+            nbytes = value.nbytes if hasattr(value, 'nbytes') else 0
+        with self._lock:
+            self._entries[key] = (value, nbytes)
+            self._entries.move_to_end(key)
+            while len(self._entries) > 1 and sum(n for _, n in self._entries.values()) > self.max_bytes:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'items': len(self._entries),
+                'bytes': sum(n for _, n in self._entries.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Cache global dipakai bersama oleh app_enhance & app_upscale (statistiknya ikut diekspor di endpoint metrik)
+result_cache = ResultCache()
+metrics.register_stats('cache:results', result_cache.stats)
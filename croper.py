@@ -11,7 +11,29 @@ import PIL
 import numpy as np
 from PIL import Image
 
+
+# Fungsi pencari bounding box mask (inklusif) lewat reduksi baris & kolom, tanpa array indeks sebesar foreground
+def mask_bbox(target_mask: np.ndarray):
+    rows = np.any(target_mask, axis=1)
+    cols = np.any(target_mask, axis=0)
+    if not rows.any():
+        raise ValueError('Mask kosong: tidak ada area yang tersegmentasi')
+    start_y = int(np.argmax(rows))
+    end_y = len(rows) - 1 - int(np.argmax(rows[::-1]))
+    start_x = int(np.argmax(cols))
+    end_x = len(cols) - 1 - int(np.argmax(cols[::-1]))
+    return start_y, end_y, start_x, end_x
+
+
 class Croper:
+    __slots__ = (
+        'input_image', 'target_mask', 'mask_size', 'mask_expansion',
+        'origin_start_x', 'origin_start_y', 'origin_end_x', 'origin_end_y',
+        'square_start_x', 'square_start_y', 'square_end_x', 'square_end_y',
+        'square_length', 'corp_mask', 'resized_square_image', 'resized_square_mask_image',
+        '_square',
+    )
+
     def __init__(
         self,
         input_image: PIL.Image,      # Gambar input (format PIL Image)
@@ -23,7 +45,8 @@ class Croper:
         self.target_mask = target_mask
         self.mask_size = mask_size
         self.mask_expansion = mask_expansion
-    
+        self._square = None
+
     # Fungsi utama untuk crop area sesuai mask dan membentuk square crop & mask
     def corp_mask_image(self):
         target_mask = self.target_mask
@@ -32,11 +55,7 @@ class Croper:
         original_width, original_height = input_image.size
 
         # Cari koordinat bounding box area mask (area bertanda True/1)
-        mask_indices = np.where(target_mask)
-        start_y = np.min(mask_indices[0])
-        end_y = np.max(mask_indices[0])
-        start_x = np.min(mask_indices[1])
-        end_x = np.max(mask_indices[1])
+        start_y, end_y, start_x, end_x = mask_bbox(target_mask)
 
         mask_height = end_y - start_y
         mask_width = end_x - start_x
@@ -47,24 +66,16 @@ class Croper:
         # Ekspansi area mask agar crop tidak terlalu sempit
         height_diff = (max_side_length - mask_height) // 2
         width_diff = (max_side_length - mask_width) // 2
-        start_y = start_y - mask_expansion - height_diff
-        if start_y < 0:
-            start_y = 0
-        end_y = end_y + mask_expansion + height_diff
-        if end_y > original_height:
-            end_y = original_height
-        start_x = start_x - mask_expansion - width_diff
-        if start_x < 0:
-            start_x = 0
-        end_x = end_x + mask_expansion + width_diff
-        if end_x > original_width:
-            end_x = original_width
+        start_y = max(0, start_y - mask_expansion - height_diff)
+        end_y = min(original_height, end_y + mask_expansion + height_diff)
+        start_x = max(0, start_x - mask_expansion - width_diff)
+        end_x = min(original_width, end_x + mask_expansion + width_diff)
 
         expanded_height = end_y - start_y
         expanded_width = end_x - start_x
         expanded_max_side_length = max(expanded_height, expanded_width)
 
-        # Crop mask dari area yang sudah diekspansi
+        # Crop mask dari area yang sudah diekspansi (view, bukan salinan)
         crop_mask = target_mask[start_y:end_y, start_x:end_x]
 
         # Hitung posisi crop mask pada square mask
@@ -73,16 +84,15 @@ class Croper:
         crop_mask_start_x = (expanded_max_side_length - expanded_width) // 2
         crop_mask_end_x = crop_mask_start_x + expanded_width
 
-        # Buat square mask dengan area crop mask di tengah
-        square_mask = np.zeros((expanded_max_side_length, expanded_max_side_length), dtype=target_mask.dtype)
-        square_mask[crop_mask_start_y:crop_mask_end_y, crop_mask_start_x:crop_mask_end_x] = crop_mask
-        square_mask_image = Image.fromarray((square_mask * 255).astype(np.uint8))
-
-        # Crop image asli sesuai area ekspansi
+        # Satu buffer square RGBX: channel RGB = crop image, channel X = mask (0/255), sisanya hitam
         crop_image = input_image.crop((start_x, start_y, end_x, end_y))
-        # Buat square image, lalu paste crop image di tengah
-        square_image = Image.new("RGB", (expanded_max_side_length, expanded_max_side_length))
-        square_image.paste(crop_image, (crop_mask_start_x, crop_mask_start_y))
+        if crop_image.mode != 'RGB':
+            crop_image = crop_image.convert('RGB')
+        square = np.zeros((expanded_max_side_length, expanded_max_side_length, 4), dtype=np.uint8)
+        square_view = square[crop_mask_start_y:crop_mask_end_y, crop_mask_start_x:crop_mask_end_x]
+        square_view[..., :3] = np.asarray(crop_image)
+        square_view[..., 3] = crop_mask
+        square_view[..., 3] *= 255
 
         # Simpan koordinat/ukuran untuk keperluan restore nanti
         self.origin_start_x = start_x
@@ -96,17 +106,29 @@ class Croper:
         self.square_end_y = crop_mask_end_y
 
         self.square_length = expanded_max_side_length
-        self.square_mask_image = square_mask_image
-        self.square_image = square_image
         self.corp_mask = crop_mask
+        self._square = square
 
-        # Resize hasil square mask & image ke mask_size (misal: 256x256) untuk kebutuhan pipeline AI
+        # Resize square image & mask ke mask_size sekaligus (satu langkah resampling untuk 4 channel;
+        # mode RGBX tidak di-premultiply, jadi hasil per channel sama dengan resize RGB & L terpisah)
         mask_size = self.mask_size
-        self.resized_square_mask_image = square_mask_image.resize((mask_size, mask_size))
-        self.resized_square_image = square_image.resize((mask_size, mask_size))
+        square_rgbx = Image.frombuffer('RGBX', (expanded_max_side_length,) * 2, square, 'raw', 'RGBX', 0, 1)
+        resized = square_rgbx.resize((mask_size, mask_size), Image.BICUBIC)
+        self.resized_square_image = resized.convert('RGB')
+        self.resized_square_mask_image = resized.getchannel(3)
 
         return self.resized_square_mask_image  # Kembalikan mask hasil resize
-    
+
+    # Square image ukuran asli (dibuat saat dibutuhkan saja)
+    @property
+    def square_image(self):
+        return Image.fromarray(np.ascontiguousarray(self._square[..., :3]))
+
+    # Square mask ukuran asli (dibuat saat dibutuhkan saja)
+    @property
+    def square_mask_image(self):
+        return Image.fromarray(np.ascontiguousarray(self._square[..., 3]))
+
     # Fungsi untuk restore hasil generate ke gambar asli dengan bantuan mask transparan
     def restore_result(self, generated_image):
         square_length = self.square_length
@@ -120,9 +142,9 @@ class Croper:
         # Tempel hasil generate ke gambar asli dengan mask transparan
         restored_image = self.input_image.copy()
         restored_image.paste(cropped_generated_image, (self.origin_start_x, self.origin_start_y), cropped_square_mask_image)
-        
+
         return restored_image
-    
+
     # Versi restore tanpa mask (area hasil tempelkan langsung tanpa transparansi)
     def restore_result_v2(self, generated_image):
         square_length = self.square_length
@@ -131,5 +153,5 @@ class Croper:
 
         restored_image = self.input_image.copy()
         restored_image.paste(cropped_generated_image, (self.origin_start_x, self.origin_start_y))
-        
+
         return restored_image
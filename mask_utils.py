@@ -0,0 +1,161 @@
+"""
+Mask Utils
+----------
+Utilitas mask biner untuk segmentasi resolusi rendah:
+- Menentukan ukuran kerja (working size) segmentasi untuk gambar besar
+- Upsampling mask hasil segmentasi ke resolusi penuh dengan refinement tepi
+  (guided filter berbasis box filter, hanya di area bounding box mask)
+- Mesin morfologi mask kategori: label diambil lewat lookup table dari satu mask kategori,
+  dilasi dihitung sekali lewat distance transform L1 (biaya tidak bergantung pada radius)
+- Pemecahan mask kategori menjadi beberapa region (connected component), misal tiap wajah di foto grup
+
+Created by _drat | 2025
+"""
+
+import os
+import math
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from croper import mask_bbox
+
+# Label MediaPipe selfie multiclass per kategori: 1 = rambut, 2 = kulit tubuh, 3 = wajah, 4 = pakaian
+CATEGORY_LABELS = {
+    'hair': (1,),
+    'face': (3,),
+    'clothes': (2, 4),
+}
+# Dilasi dasar per kategori (ditambahkan ke dilasi dari UI); pakaian selalu diperlebar 4 piksel
+CATEGORY_BASE_DILATION = {
+    'clothes': 4,
+}
+# Batas jumlah region per kategori & luas minimum region relatif terhadap region terbesar (buang bercak kecil)
+MAX_REGIONS = int(os.environ.get('MAX_REGIONS', 8))
+REGION_MIN_RATIO = float(os.environ.get('REGION_MIN_RATIO', 0.05))
+
+
+# Lookup table 256 entri: True untuk label yang termasuk kategori
+@lru_cache(maxsize=None)
+def category_lut(labels):
+    lut = np.zeros(256, dtype=bool)
+    lut[list(labels)] = True
+    return lut
+
+
+# Fungsi dilasi biner dengan elemen struktur silang sebanyak `radius` iterasi, dihitung sekali.
+# Dilasi silang berulang n kali = semua piksel dengan jarak L1 (manhattan) <= n ke piksel mask,
+# jadi hasilnya identik dengan scipy binary_dilation(mask, iterations=n) (border_value=0)
+def dilate_l1(mask, radius):
+    if radius <= 0:
+        return mask
+    height, width = mask.shape
+    if not mask.any():
+        return np.zeros((height, width), dtype=bool)
+
+    # Hanya area bounding box mask (+radius) yang bisa berubah
+    y0, y1, x0, x1 = mask_bbox(mask)
+    y0, x0 = max(0, y0 - radius), max(0, x0 - radius)
+    y1, x1 = min(height, y1 + 1 + radius), min(width, x1 + 1 + radius)
+
+    # distanceTransform mengukur jarak ke piksel nol -> piksel mask dijadikan nol
+    source = np.logical_not(mask[y0:y1, x0:x1]).view(np.uint8)
+    dst_type = cv2.CV_8U if radius < 255 else cv2.CV_32F  # CV_8U jenuh di 255, cukup untuk radius kecil
+    distance = cv2.distanceTransform(source, cv2.DIST_L1, cv2.DIST_MASK_3, dstType=dst_type)
+
+    dilated = np.zeros((height, width), dtype=bool)
+    dilated[y0:y1, x0:x1] = distance <= radius
+    return dilated
+
+
+# Fungsi mask kategori (rambut / wajah / pakaian) dari mask kategori segmentasi + dilasi
+def category_target_mask(category_mask, category, dilation=1):
+    labels = CATEGORY_LABELS[category]
+    target_mask = np.take(category_lut(labels), category_mask)
+    radius = CATEGORY_BASE_DILATION.get(category, 0) + max(0, int(dilation))
+    return dilate_l1(target_mask, radius)
+
+
+# Fungsi pemecah mask kategori menjadi region terpisah (connected component 8-arah), masing-masing didilasi.
+# Komponen dipisah sebelum dilasi supaya dua wajah yang berdekatan tetap menjadi dua region
+def category_region_masks(category_mask, category, dilation=1, min_ratio=REGION_MIN_RATIO, max_regions=MAX_REGIONS):
+    selected = np.take(category_lut(CATEGORY_LABELS[category]), category_mask)
+    radius = CATEGORY_BASE_DILATION.get(category, 0) + max(0, int(dilation))
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(selected.view(np.uint8), connectivity=8)
+    if count <= 1:
+        return []
+
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    order = np.argsort(areas)[::-1][:max_regions]
+    masks = []
+    for index in order:
+        if areas[index] < min_ratio * areas[order[0]]:
+            break
+        label = index + 1
+        x, y, w, h = stats[label, :4]
+        component = np.zeros(selected.shape, dtype=bool)
+        component[y:y + h, x:x + w] = labels[y:y + h, x:x + w] == label
+        masks.append(dilate_l1(component, radius))
+    return masks
+
+
+# Fungsi ukuran kerja: sisi terpanjang dibatasi working_size (None jika tidak perlu diperkecil)
+def working_size_for(size, working_size):
+    width, height = size
+    if not working_size or max(width, height) <= working_size:
+        return None
+    factor = working_size / max(width, height)
+    return max(1, round(width * factor)), max(1, round(height * factor))
+
+
+# Fungsi untuk mengubah jumlah iterasi dilasi (piksel resolusi penuh) ke resolusi kerja
+def scale_dilation(dilation, factor):
+    if dilation <= 0:
+        return 0
+    return max(1, int(round(dilation * factor)))
+
+
+# Guided filter (He et al.) dengan box filter: tepi mask mengikuti tepi pada gambar panduan
+def guided_filter(guide, source, radius, eps):
+    ksize = (2 * radius + 1, 2 * radius + 1)
+
+    def box(x):
+        return cv2.boxFilter(x, -1, ksize, borderType=cv2.BORDER_REFLECT)
+
+    mean_i = box(guide)
+    mean_p = box(source)
+    cov_ip = box(guide * source) - mean_i * mean_p
+    var_i = box(guide * guide) - mean_i * mean_i
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    return box(a) * guide + box(b)
+
+
+# Fungsi upsampling mask ke resolusi penuh; refinement tepi memakai gambar asli sebagai panduan
+def upsample_mask(mask_small, full_size, guide_image: Image = None, eps=1e-3, margin=2):
+    width, height = full_size
+    small_h, small_w = mask_small.shape[:2]
+    full_mask = np.zeros((height, width), dtype=bool)
+    if not mask_small.any():
+        return full_mask
+
+    # Area kerja = bounding box mask (+margin) di resolusi kecil, dipetakan ke resolusi penuh
+    y0, y1, x0, x1 = mask_bbox(mask_small)
+    y0, x0 = max(0, y0 - margin), max(0, x0 - margin)
+    y1, x1 = min(small_h, y1 + 1 + margin), min(small_w, x1 + 1 + margin)
+    scale_y, scale_x = height / small_h, width / small_w
+    fy0, fx0 = int(y0 * scale_y), int(x0 * scale_x)
+    fy1, fx1 = min(height, math.ceil(y1 * scale_y)), min(width, math.ceil(x1 * scale_x))
+
+    soft = cv2.resize(
+        mask_small[y0:y1, x0:x1].astype(np.float32), (fx1 - fx0, fy1 - fy0), interpolation=cv2.INTER_LINEAR
+    )
+    if guide_image is not None:
+        guide = np.asarray(guide_image.crop((fx0, fy0, fx1, fy1)).convert('L'), dtype=np.float32) / 255.
+        radius = max(1, int(round(max(scale_x, scale_y))))
+        soft = guided_filter(guide, soft, radius, eps)
+
+    full_mask[fy0:fy1, fx0:fx1] = soft > 0.5
+    return full_mask
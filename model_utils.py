@@ -0,0 +1,277 @@
+"""
+Model Utils
+-----------
+Provider model AI bersama (lazy) untuk app_enhance, enhance_utils, dll:
+- Download bobot & pembangunan model baru dilakukan saat pertama dipakai (atau lewat warmup())
+- Satu instance Real-ESRGAN dipakai bersama oleh semua modul (tidak ada bobot ganda)
+- Registry GFPGANer dengan eviction LRU (jumlah instance & batas memori) + counter hit/miss
+- Laporan waktu startup per modul & per model
+
+Created by _drat | 2025
+"""
+
+import os
+import time
+import weakref
+import threading
+import subprocess
+from collections import OrderedDict
+
+import torch
+
+from trace_utils import metrics
+
+# Path & URL bobot model
+GFPGAN_MODEL_PATH = 'GFPGANv1.4.pth'
+GFPGAN_MODEL_URL = 'https://github.com/TencentARC/GFPGAN/releases/download/v1.3.0/GFPGANv1.4.pth'
+REALESRGAN_MODEL_PATH = 'realesr-general-x4v3.pth'
+REALESRGAN_MODEL_URL = 'https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-x4v3.pth'
+
+# Catatan waktu startup: nama ("module:..." / "model:...") -> detik
+_startup_timings = OrderedDict()
+# Interval (mulai, selesai) setiap catatan; entry bisa bertingkat (import app berisi import app_enhance, dll)
+_startup_intervals = []
+
+# Fungsi untuk menjalankan command shell (misal: wget file model)
+def runcmd(cmd, verbose = False):
+    process = subprocess.Popen(
+        cmd,
+        stdout = subprocess.PIPE,
+        stderr = subprocess.PIPE,
+        text = True,
+        shell = True
+    )
+    std_out, std_err = process.communicate()
+    if verbose:
+        print(std_out.strip(), std_err)
+    pass
+
+
+# Fungsi untuk memastikan file bobot model ada (download jika belum)
+def ensure_weights(path, url):
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        runcmd(f"wget {url} -P .")
+        record_startup(f'download:{path}', time.perf_counter() - start)
+    return path
+
+
+# Fungsi pencatat waktu startup (import modul, download, build model); dipanggil tepat setelah tahapnya selesai
+def record_startup(name, seconds):
+    end = time.perf_counter()
+    _startup_timings[name] = _startup_timings.get(name, 0.0) + seconds
+    _startup_intervals.append((end - seconds, end, name))
+
+
+# Fungsi total waktu startup = panjang gabungan interval (entry bertingkat tidak dihitung dua kali)
+def startup_total():
+    total, covered_until = 0.0, float('-inf')
+    for start, end, _ in sorted(_startup_intervals):
+        if end > covered_until:
+            total += end - max(start, covered_until)
+            covered_until = end
+    return total
+
+
+# Fungsi laporan waktu startup (dict terurut + teks ringkas untuk log); di teks, entry yang berada
+# di dalam entry lain (misal module:app_enhance di dalam module:app) ditandai dengan indentasi
+def startup_report(as_text=False):
+    report = dict(_startup_timings)
+    if not as_text:
+        return report
+    nested = {
+        name for start, end, name in _startup_intervals
+        if any(o_start <= start and end <= o_end and o_name != name for o_start, o_end, o_name in _startup_intervals)
+    }
+    lines = [
+        f'{("  " if name in nested else "") + name:<40} {seconds * 1000:10.1f} ms' for name, seconds in report.items()
+    ]
+    lines.append(f'{"total (wall, tanpa entry bertingkat)":<40} {startup_total() * 1000:10.1f} ms')
+    return '\n'.join(lines)
+
+
+# Fungsi untuk mengestimasi memori (byte) parameter & buffer semua nn.Module di dalam sebuah objek
+def estimate_model_bytes(obj, depth=2, _seen=None):
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    if isinstance(obj, torch.nn.Module):
+        tensors = list(obj.parameters()) + list(obj.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    # Objek wrapper (GFPGANer, FaceRestoreHelper, RealESRGANer): telusuri atributnya
+    total = 0
+    if depth > 0 and hasattr(obj, '__dict__'):
+        for value in vars(obj).values():
+            total += estimate_model_bytes(value, depth - 1, _seen)
+    return total
+
+
+class ModelRegistry:
+    def __init__(
+        self,
+        max_items: int = 4,                   # Jumlah maksimum instance yang disimpan
+        max_bytes: int = 2 * 1024 ** 3,       # Batas memori total (estimasi) semua instance
+        name: str = 'models',                 # Nama registry (untuk log)
+    ):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (instance, ukuran byte)
+        self._building = {}            # key -> lock pembangunan instance yang sedang berjalan
+        self._lock = threading.Lock()
+
+    # Ambil instance dari registry; jika belum ada, bangun lewat factory lalu simpan.
+    # Factory dijalankan di luar lock registry (cache hit key lain tidak ikut menunggu), dengan lock per key
+    # supaya key yang sama tidak dibangun dua kali bersamaan
+    def get(self, key, factory):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            build_lock = self._building.setdefault(key, threading.Lock())
+
+        with build_lock:
+            with self._lock:
+                if key in self._entries:  # Baru saja dibangun thread lain
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+
+            try:
+                instance = factory()
+                size = estimate_model_bytes(instance)
+                with self._lock:
+                    self.misses += 1
+                    self._entries[key] = (instance, size)
+                    self._evict(keep=key)
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+            return instance
+
+    # Buang instance paling lama tidak dipakai sampai batas jumlah & memori terpenuhi
+    def _evict(self, keep=None):
+        while self._entries and (
+            len(self._entries) > self.max_items or self.total_bytes() > self.max_bytes
+        ):
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break  # Instance yang baru saja dibangun selalu dipertahankan
+            del self._entries[oldest]
+            self.evictions += 1
+
+    def total_bytes(self):
+        return sum(size for _, size in self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # Ringkasan counter registry (untuk log / monitoring)
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'items': len(self._entries),
+                'bytes': self.total_bytes(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Lock per instance model yang punya state per pemanggilan (misal GFPGANer.face_helper): instance dari registry
+# dipakai bersama semua request, jadi bagian yang mengubah state-nya harus dijalankan bergantian
+_instance_locks = weakref.WeakKeyDictionary()
+_instance_locks_lock = threading.Lock()
+
+
+def instance_lock(instance):
+    with _instance_locks_lock:
+        lock = _instance_locks.get(instance)
+        if lock is None:
+            lock = _instance_locks[instance] = threading.Lock()
+        return lock
+
+
+# Registry global untuk instance GFPGANer (statistiknya ikut diekspor di endpoint metrik)
+face_enhancer_registry = ModelRegistry(max_items=4, name='gfpgan')
+metrics.register_stats('registry:gfpgan', face_enhancer_registry.stats)
+
+
+# Fungsi untuk mengambil GFPGANer yang sudah di-cache berdasarkan (scale, arch, bg_upsampler)
+def get_face_enhancer(scale: int, arch: str = 'clean', bg_upsampler=None):
+    key = (int(scale), arch, bg_upsampler)
+
+    def factory():
+        from gfpgan.utils import GFPGANer  # Import berat (basicsr/facexlib), ditunda sampai dibutuhkan
+
+        start = time.perf_counter()
+        face_enhancer = GFPGANer(
+            model_path=ensure_weights(GFPGAN_MODEL_PATH, GFPGAN_MODEL_URL), upscale=int(scale),
+            arch=arch, channel_multiplier=2, bg_upsampler=bg_upsampler
+        )
+        record_startup(f'model:gfpgan(scale={int(scale)}, arch={arch}, bg={bg_upsampler is not None})', time.perf_counter() - start)
+        return face_enhancer
+
+    return face_enhancer_registry.get(key, factory)
+
+
+# Instance Real-ESRGAN bersama (dibangun sekali saat pertama dipakai)
+_upsampler = None
+_upsampler_lock = threading.Lock()
+
+
+# Fungsi untuk mengambil upsampler Real-ESRGAN bersama (lazy, thread-safe)
+def get_upsampler():
+    global _upsampler
+    if _upsampler is not None:
+        return _upsampler
+    with _upsampler_lock:
+        if _upsampler is None:
+            from basicsr.archs.srvgg_arch import SRVGGNetCompact
+            from tile_utils import TiledRealESRGANer
+            from batch_utils import BATCH_ENABLED, enable_batching
+            from backend_utils import UPSCALE_BACKEND, select_backend
+
+            start = time.perf_counter()
+            model = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=4, act_type='prelu')
+            half = True if torch.cuda.is_available() else False  # Pakai mode half-precision jika ada GPU (lebih cepat)
+            upsampler = TiledRealESRGANer(
+                scale=4, model_path=ensure_weights(REALESRGAN_MODEL_PATH, REALESRGAN_MODEL_URL), model=model,
+                tile=0, tile_pad=10, pre_pad=0, half=half
+            )
+            # Backend inference (eager / torchscript / onnx / int8), dipasang sebelum scheduler batching memakai model
+            upsampler.model = select_backend(UPSCALE_BACKEND, upsampler.model, REALESRGAN_MODEL_PATH)
+            if BATCH_ENABLED:
+                enable_batching(upsampler)  # Forward pass dari beberapa request digabung jadi satu batch
+            record_startup(f"model:realesrgan[{getattr(upsampler.model, 'name', 'eager')}]", time.perf_counter() - start)
+            _upsampler = upsampler
+    return _upsampler
+
+
+# Fungsi untuk mengganti upsampler bersama (misal: model stand-in untuk benchmark offline)
+def set_upsampler(upsampler):
+    global _upsampler
+    with _upsampler_lock:
+        _upsampler = upsampler
+
+
+# Fungsi warmup eksplisit: bangun semua model yang dibutuhkan sebelum request pertama
+def warmup(face_scales=(1, 2), combined=True):
+    upsampler = get_upsampler()
+    for scale in face_scales:
+        get_face_enhancer(scale)
+        if combined:
+            get_face_enhancer(scale, bg_upsampler=upsampler)
+    return startup_report()
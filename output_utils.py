@@ -0,0 +1,156 @@
+"""
+Output Utils
+------------
+Penyimpanan file hasil (output/) yang tidak memblokir request:
+- Encoding gambar dijalankan di thread pool background, preview bisa langsung dikembalikan ke UI
+- Opsi encoding per format (PNG compress_level, WebP, JPEG)
+- Folder output dibatasi ukuran total & umur file (file lama otomatis dihapus)
+
+Created by _drat | 2025
+"""
+
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from trace_utils import span
+
+# Konfigurasi default (bisa dioverride lewat environment variable)
+OUTPUT_DIR = os.environ.get('OUTPUT_DIR', 'output/')
+OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'png')                       # png / webp / jpeg
+OUTPUT_PNG_COMPRESS_LEVEL = int(os.environ.get('OUTPUT_PNG_COMPRESS_LEVEL', 3))  # 0 (cepat) .. 9 (kecil)
+OUTPUT_QUALITY = int(os.environ.get('OUTPUT_QUALITY', 95))                   # Untuk WebP / JPEG
+OUTPUT_MAX_MB = int(os.environ.get('OUTPUT_MAX_MB', 2048))
+OUTPUT_MAX_AGE_S = int(os.environ.get('OUTPUT_MAX_AGE_S', 24 * 3600))
+OUTPUT_WORKERS = int(os.environ.get('OUTPUT_WORKERS', 2))
+
+# Ekstensi file per format
+EXTENSIONS = {'png': 'png', 'webp': 'webp', 'jpeg': 'jpg'}
+
+
+# Fungsi opsi encoding PIL sesuai format
+def encode_options(fmt):
+    if fmt == 'png':
+        return {'compress_level': OUTPUT_PNG_COMPRESS_LEVEL}
+    if fmt == 'webp':
+        return {'quality': OUTPUT_QUALITY, 'method': 4}
+    if fmt == 'jpeg':
+        return {'quality': OUTPUT_QUALITY, 'subsampling': 0}
+    raise ValueError(f'Format output tidak didukung: {fmt}')
+
+
+class OutputStore:
+    def __init__(
+        self,
+        target_dir: str = OUTPUT_DIR,          # Folder tujuan file hasil
+        fmt: str = OUTPUT_FORMAT,              # Format default
+        max_mb: int = OUTPUT_MAX_MB,           # Batas ukuran total folder (file langsung di folder ini)
+        max_age_s: int = OUTPUT_MAX_AGE_S,     # Umur maksimum file
+        workers: int = OUTPUT_WORKERS,         # Jumlah thread encoder
+    ):
+        self.target_dir = target_dir
+        self.fmt = fmt
+        self.max_bytes = max_mb * 1024 * 1024
+        self.max_age_s = max_age_s
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='output-encoder')
+        self._pending = {}  # path -> Future
+        self._lock = threading.Lock()
+        self._limits_lock = threading.Lock()  # enforce_limits dipanggil dari semua thread encoder
+        os.makedirs(target_dir, exist_ok=True)
+
+    # Simpan gambar di background; path langsung dikembalikan (file siap setelah wait(path))
+    def save(self, image: Image, fmt: str = None, on_saved=None) -> str:
+        fmt = fmt or self.fmt
+        path = os.path.join(self.target_dir, f'{uuid.uuid4()}.{EXTENSIONS[fmt]}')
+        future = self._executor.submit(self._encode, image, path, fmt)
+        with self._lock:
+            self._pending[path] = future
+
+        def done(f):
+            with self._lock:
+                self._pending.pop(path, None)
+            if on_saved is not None and f.exception() is None:
+                on_saved(path)
+
+        future.add_done_callback(done)
+        return path
+
+    def _encode(self, image, path, fmt):
+        if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        # Tulis ke file sementara lalu rename, supaya file tidak pernah terbaca setengah jadi
+        tmp_path = f'{path}.tmp'
+        with span('encode', size=image.size, format=fmt):
+            image.save(tmp_path, format=fmt.upper(), **encode_options(fmt))
+        os.replace(tmp_path, path)
+        self.enforce_limits()
+        return path
+
+    # Jalankan callback setelah file selesai ditulis (langsung jika sudah selesai)
+    def when_saved(self, path, callback):
+        with self._lock:
+            future = self._pending.get(path)
+        if future is None:
+            if os.path.exists(path):
+                callback(path)
+            return
+        future.add_done_callback(lambda f: f.exception() is None and callback(path))
+
+    # Tunggu sampai file selesai ditulis, lalu kembalikan path-nya
+    def wait(self, path, timeout=None):
+        with self._lock:
+            future = self._pending.get(path)
+        if future is not None:
+            future.result(timeout=timeout)
+        return path
+
+    # Hapus file yang terlalu lama, lalu file tertua sampai ukuran total di bawah batas.
+    # Dijalankan bergantian antar thread encoder (seperti eviction disk di cache_utils); file yang sudah
+    # hilang (dihapus di luar proses / cache) dilewati, supaya future encode tidak gagal setelah file ditulis
+    def enforce_limits(self):
+        with self._limits_lock:
+            now = time.time()
+            with self._lock:
+                pending = set(self._pending)
+            files = []
+            for entry in os.scandir(self.target_dir):
+                if entry.path in pending or entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.max_age_s:
+                    self._remove(entry.path)
+                else:
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# Store global dipakai bersama oleh app_enhance & segment_utils
+output_store = OutputStore()
+
+
+# Fungsi untuk UI: tunggu file hasil selesai di-encode (dipakai di .then() setelah preview tampil)
+def wait_for_output(path):
+    if not path:
+        return None
+    return output_store.wait(path)
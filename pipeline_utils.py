@@ -0,0 +1,224 @@
+"""
+Pipeline Utils
+--------------
+Profil eksekusi untuk StableDiffusionUpscalePipeline:
+- GPU: float16 seperti sebelumnya
+- CPU: float32 atau bfloat16, attention slicing, memory format channels_last,
+  jumlah thread yang bisa diatur, dan kompilasi graph UNet (opsional, torch.compile)
+- Upscale berbasis tile (tile piksel yang saling overlap, sambungan di-blend) untuk crop/gambar besar,
+  dengan jumlah tile per batch dibatasi budget memori dan progress per tile
+- Semua pengaturan bisa dioverride lewat environment variable
+
+Created by _drat | 2025
+"""
+
+import os
+import math
+
+import numpy as np
+import torch
+from PIL import Image
+
+from stream_utils import compose_preview
+from tile_utils import _ramp
+from trace_utils import span
+
+# Konfigurasi default (bisa dioverride lewat environment variable)
+UPSCALE_DTYPE = os.environ.get('UPSCALE_DTYPE', 'auto')                  # auto / float16 / float32 / bfloat16
+UPSCALE_ATTENTION_SLICING = os.environ.get('UPSCALE_ATTENTION_SLICING', 'auto')  # auto / 1 / 0
+UPSCALE_CHANNELS_LAST = os.environ.get('UPSCALE_CHANNELS_LAST', 'auto')  # auto / 1 / 0
+UPSCALE_COMPILE = os.environ.get('UPSCALE_COMPILE', '0') == '1'
+CPU_THREADS = int(os.environ.get('CPU_THREADS', 0))                      # 0 = default torch
+CPU_INTEROP_THREADS = int(os.environ.get('CPU_INTEROP_THREADS', 0))
+# Upscale tile: sisi tile input (kelipatan 8, 0 = tanpa tile), overlap antar tile, dan budget memori semua tile dalam satu batch
+SD_TILE_SIZE = int(os.environ.get('SD_TILE_SIZE', 512))
+SD_TILE_OVERLAP = int(os.environ.get('SD_TILE_OVERLAP', 32))
+SD_TILE_MEMORY_MB = int(os.environ.get('SD_TILE_MEMORY_MB', 4096))
+# Estimasi memori puncak per piksel input (float32); didominasi up block terakhir decoder VAE di resolusi output 4x:
+# 128 channel x 16 piksel output x 4 byte x ~1.5 aktivasi hidup = 12 KiB (tile 512x512 float32 ~3 GB, float16 ~1.5 GB)
+SD_BYTES_PER_PIXEL = 12 * 1024
+SD_SCALE = 4
+
+DTYPES = {
+    'float16': torch.float16,
+    'float32': torch.float32,
+    'bfloat16': torch.bfloat16,
+}
+
+
+# Fungsi membaca flag 'auto' / '1' / '0' (atau bool langsung)
+def _flag(value, auto):
+    if isinstance(value, bool):
+        return value
+    if value == 'auto':
+        return auto
+    return value == '1'
+
+
+class ExecutionProfile:
+    def __init__(
+        self,
+        device: str,                      # "cuda" atau "cpu"
+        dtype: str = UPSCALE_DTYPE,       # auto: float16 di GPU, float32 di CPU (float16 di CPU sangat lambat / gagal)
+        attention_slicing=UPSCALE_ATTENTION_SLICING,  # auto: aktif di CPU (menekan peak memori attention)
+        channels_last=UPSCALE_CHANNELS_LAST,          # auto: aktif di CPU (konvolusi oneDNN lebih cepat)
+        compile: bool = UPSCALE_COMPILE,  # torch.compile untuk UNet (waktu warmup lebih lama)
+        num_threads: int = CPU_THREADS,
+        interop_threads: int = CPU_INTEROP_THREADS,
+    ):
+        on_cpu = device == 'cpu'
+        if dtype == 'auto':
+            dtype = 'float32' if on_cpu else 'float16'
+        self.device = device
+        self.dtype_name = dtype
+        self.dtype = DTYPES[dtype]
+        self.attention_slicing = _flag(attention_slicing, on_cpu)
+        self.channels_last = _flag(channels_last, on_cpu)
+        self.compile = compile
+        self.num_threads = num_threads
+        self.interop_threads = interop_threads
+
+    def describe(self):
+        return {
+            'device': self.device,
+            'dtype': self.dtype_name,
+            'attention_slicing': self.attention_slicing,
+            'channels_last': self.channels_last,
+            'compile': self.compile,
+            'num_threads': torch.get_num_threads(),
+        }
+
+
+# Fungsi pengaturan jumlah thread CPU (interop hanya bisa diset sekali, sebelum ada kerja paralel)
+def apply_threads(profile: ExecutionProfile):
+    if profile.num_threads > 0:
+        torch.set_num_threads(profile.num_threads)
+    if profile.interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(profile.interop_threads)
+        except RuntimeError:
+            print('[pipeline] interop threads sudah diset, dilewati')
+
+
+# Fungsi menerapkan profil ke pipeline yang sudah di-load (device, dtype, slicing, memory format, compile)
+def configure_pipeline(pipe, profile: ExecutionProfile):
+    apply_threads(profile)
+    pipe = pipe.to(profile.device, profile.dtype)
+    if profile.attention_slicing:
+        pipe.enable_attention_slicing()
+    else:
+        pipe.disable_attention_slicing()
+    if profile.channels_last:
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+    if profile.compile and hasattr(torch, 'compile'):
+        pipe.unet = torch.compile(pipe.unet)
+    return pipe
+
+
+# Fungsi posisi awal tile sepanjang satu sumbu (ukuran tile tetap supaya tile bisa di-batch, overlap >= overlap)
+def _tile_starts(size, tile, overlap):
+    if size <= tile:
+        return [0]
+    count = math.ceil((size - overlap) / (tile - overlap))
+    return np.linspace(0, size - tile, count).round().astype(int).tolist()
+
+
+# Fungsi jumlah tile per panggilan pipeline dari budget memori
+def plan_tile_batch(tile_width, tile_height, memory_budget_mb=SD_TILE_MEMORY_MB, dtype_bytes=4):
+    per_tile = tile_width * tile_height * SD_BYTES_PER_PIXEL * dtype_bytes / 4
+    return max(1, int(memory_budget_mb * 1024 * 1024 // per_tile))
+
+
+# Fungsi sisi tile terbesar (kelipatan 8) yang satu tile-nya masih muat di budget memori
+def max_tile_size(memory_budget_mb=SD_TILE_MEMORY_MB, dtype_bytes=4):
+    pixels = memory_budget_mb * 1024 * 1024 / (SD_BYTES_PER_PIXEL * dtype_bytes / 4)
+    return max(8, int(math.sqrt(pixels)) // 8 * 8)
+
+
+# Fungsi upscale SD berbasis tile: tile overlap diproses per batch (sesuai budget memori), output di-blend
+# dengan bobot feathering lalu dinormalisasi. progress(selesai, total) dipanggil setiap batch tile selesai,
+# on_partial(render) juga (render(max_size) -> preview PIL hasil blend sementara, dibuat hanya jika dipanggil)
+def tiled_upscale(
+    pipe,
+    image: Image,
+    prompt: str,
+    num_inference_steps: int,
+    tile_size: int = SD_TILE_SIZE,
+    overlap: int = SD_TILE_OVERLAP,
+    memory_budget_mb: int = SD_TILE_MEMORY_MB,
+    progress=None,
+    on_partial=None,
+):
+    width, height = image.size
+    tile_size = tile_size // 8 * 8  # Latent UNet/VAE butuh kelipatan 8
+    dtype_bytes = torch.finfo(pipe.unet.dtype).bits // 8
+    if tile_size > 0 and tile_size > max_tile_size(memory_budget_mb, dtype_bytes):
+        # Satu tile saja sudah melebihi budget: perkecil tile daripada diam-diam jalan dengan batch 1 di atas budget
+        fitted = max_tile_size(memory_budget_mb, dtype_bytes)
+        print(f'[pipeline] tile {tile_size}px melebihi budget {memory_budget_mb} MB, diperkecil ke {fitted}px')
+        tile_size = fitted
+    if tile_size <= 0 or (width <= tile_size and height <= tile_size):
+        with span('inference_tile', size=image.size, tiles=1):
+            upscaled = pipe(prompt=prompt, image=image, num_inference_steps=num_inference_steps).images[0]
+        if progress is not None:
+            progress(1, 1)
+        return upscaled
+
+    tile_width, tile_height = min(tile_size, width), min(tile_size, height)
+    overlap = min(overlap, tile_size // 2)
+    tiles = [
+        (x, y)
+        for y in _tile_starts(height, tile_height, overlap)
+        for x in _tile_starts(width, tile_width, overlap)
+    ]
+    batch_size = plan_tile_batch(tile_width, tile_height, memory_budget_mb, dtype_bytes)
+
+    scale = SD_SCALE
+    out_width, out_height = tile_width * scale, tile_height * scale
+    output = np.zeros((height * scale, width * scale, 3), dtype=np.float32)
+    weight_sum = np.zeros((height * scale, width * scale, 1), dtype=np.float32)
+
+    # Preview hasil sementara: subsampling output & bobot, area yang belum selesai memakai crop input
+    def render(max_size):
+        step = max(1, math.ceil(max(output.shape[:2]) / max_size))
+        weights = weight_sum[::step, ::step]
+        partial = np.clip(output[::step, ::step] / np.maximum(weights, 1e-8) + 0.5, 0, 255).astype(np.uint8)
+        return compose_preview(image.convert('RGB'), partial, weights[..., 0] > 0)
+
+    done = 0
+    for start in range(0, len(tiles), batch_size):
+        batch = tiles[start:start + batch_size]
+        crops = [image.crop((x, y, x + tile_width, y + tile_height)) for x, y in batch]
+        with span('inference_tile', size=(tile_width, tile_height), tiles=len(batch), total=len(tiles)):
+            upscaled = pipe(prompt=[prompt] * len(batch), image=crops, num_inference_steps=num_inference_steps).images
+
+        for (x, y), tile_image in zip(batch, upscaled):
+            if tile_image.size != (out_width, out_height):
+                tile_image = tile_image.resize((out_width, out_height), Image.BICUBIC)
+            # Ramp hanya di sisi yang bersambung dengan tile tetangga
+            weight_y = _ramp(out_height, overlap * scale if y > 0 else 0, overlap * scale if y + tile_height < height else 0)
+            weight_x = _ramp(out_width, overlap * scale if x > 0 else 0, overlap * scale if x + tile_width < width else 0)
+            weight = np.outer(weight_y, weight_x)[..., None]
+            oy, ox = y * scale, x * scale
+            output[oy:oy + out_height, ox:ox + out_width] += np.asarray(tile_image, dtype=np.float32) * weight
+            weight_sum[oy:oy + out_height, ox:ox + out_width] += weight
+
+        done += len(batch)
+        if progress is not None:
+            progress(done, len(tiles))
+        if on_partial is not None and done < len(tiles):
+            on_partial(render)
+
+    output /= np.maximum(weight_sum, 1e-8)
+    return Image.fromarray(np.clip(output + 0.5, 0, 255).astype(np.uint8))
+
+
+# Fungsi load StableDiffusionUpscalePipeline sesuai profil eksekusi
+def load_upscale_pipeline(model_id: str, profile: ExecutionProfile):
+    from diffusers import StableDiffusionUpscalePipeline
+
+    pipe = StableDiffusionUpscalePipeline.from_pretrained(model_id, torch_dtype=profile.dtype)
+    pipe = configure_pipeline(pipe, profile)
+    print(f'[pipeline] {model_id}: {profile.describe()}')
+    return pipe
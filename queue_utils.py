@@ -0,0 +1,148 @@
+"""
+Queue Utils
+-----------
+Antrean worker per model di antara handler UI dan model:
+- Setiap model (Real-ESRGAN, GFPGAN, Stable Diffusion upscaler) punya antrean & batas concurrency sendiri,
+  jadi satu request SD yang lambat tidak menahan request enhance yang cepat
+- Panjang antrean dibatasi; request di atas batas langsung ditolak dengan pesan "sibuk" (backpressure)
+- Lane prioritas: gambar kecil didahulukan, dengan aging supaya lane normal tidak kelaparan
+- Waktu tunggu & waktu layanan per lane dicatat sebagai metrik stage (queue_wait:* / queue_service:*)
+
+Created by _drat | 2025
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from trace_utils import metrics, span
+from worker_utils import INFERENCE_WORKERS, workers_enabled
+
+# Batas piksel input untuk lane "small" (didahulukan)
+QUEUE_SMALL_PIXELS = int(os.environ.get('QUEUE_SMALL_PIXELS', 1024 * 1024))
+# Request di lane normal yang sudah menunggu selama ini didahulukan walaupun lane small masih berisi (detik)
+QUEUE_AGING_S = float(os.environ.get('QUEUE_AGING_S', 10))
+# Konfigurasi default per model: (concurrency, panjang antrean maksimum);
+# override: QUEUE_<NAMA>_CONCURRENCY & QUEUE_<NAMA>_MAX (misal QUEUE_SD_UPSCALE_MAX=2)
+QUEUE_DEFAULTS = {
+    'realesrgan': (2, 32),
+    'gfpgan': (1, 16),
+    'sd_upscale': (1, 4),
+}
+# Model yang inference-nya dijalankan worker process saat INFERENCE_WORKERS > 0:
+# concurrency default-nya mengikuti jumlah worker (bukan nilai QUEUE_DEFAULTS untuk inference di proses server)
+WORKER_QUEUES = ('realesrgan', 'gfpgan')
+LANES = ('small', 'normal')
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class ModelQueue:
+    def __init__(
+        self,
+        name: str,
+        concurrency: int = 1,                  # Jumlah request yang boleh memakai model bersamaan
+        max_queue: int = 16,                   # Jumlah request menunggu maksimum (semua lane)
+        small_pixels: int = QUEUE_SMALL_PIXELS,
+        aging_s: float = QUEUE_AGING_S,
+    ):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.small_pixels = small_pixels
+        self.aging_s = aging_s
+        self.running = 0
+        self.served = {lane: 0 for lane in LANES}
+        self.rejected = {lane: 0 for lane in LANES}
+        self._lanes = {lane: deque() for lane in LANES}  # Tiket menunggu: [waktu masuk]
+        self._condition = threading.Condition()
+
+    def lane_for(self, pixels):
+        return 'small' if pixels is not None and pixels <= self.small_pixels else 'normal'
+
+    def waiting(self):
+        return sum(len(tickets) for tickets in self._lanes.values())
+
+    # Tiket berikutnya yang boleh jalan: kepala lane small, kecuali kepala lane normal sudah menunggu > aging_s
+    def _next_ticket(self):
+        small, normal = self._lanes['small'], self._lanes['normal']
+        if normal and (not small or time.monotonic() - normal[0][0] > self.aging_s):
+            return normal[0]
+        return small[0] if small else None
+
+    # Context manager: tunggu giliran di lane sesuai ukuran input, lalu pakai satu slot model.
+    # Raise QueueFullError jika antrean sudah penuh
+    @contextmanager
+    def slot(self, pixels=None, lane=None):
+        lane = lane or self.lane_for(pixels)
+        ticket = [time.monotonic()]
+        with span(f'queue_wait:{self.name}:{lane}', model=self.name, lane=lane) as attrs:
+            with self._condition:
+                if self.waiting() >= self.max_queue:
+                    self.rejected[lane] += 1
+                    raise QueueFullError(f'Server sedang sibuk ({self.name}), silakan coba lagi sebentar lagi')
+                self._lanes[lane].append(ticket)
+                attrs['position'] = self.waiting()
+                try:
+                    # Timeout berkala supaya aging tetap dievaluasi walaupun tidak ada notifikasi
+                    while not (self.running < self.concurrency and self._next_ticket() is ticket):
+                        self._condition.wait(timeout=0.5)
+                finally:
+                    self._lanes[lane].remove(ticket)
+                    self._condition.notify_all()
+                self.running += 1
+
+        try:
+            with span(f'queue_service:{self.name}:{lane}', model=self.name, lane=lane):
+                yield lane
+        finally:
+            with self._condition:
+                self.running -= 1
+                self.served[lane] += 1
+                self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'name': self.name,
+                'concurrency': self.concurrency,
+                'running': self.running,
+                'waiting': {lane: len(tickets) for lane, tickets in self._lanes.items()},
+                'max_queue': self.max_queue,
+                'served': dict(self.served),
+                'rejected': dict(self.rejected),
+            }
+
+
+# Registry antrean per model (dibuat saat pertama dipakai, konfigurasi dari environment variable)
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_queue(name: str) -> ModelQueue:
+    with _queues_lock:
+        if name not in _queues:
+            concurrency, max_queue = QUEUE_DEFAULTS.get(name, (1, 16))
+            if name in WORKER_QUEUES and workers_enabled():
+                concurrency = INFERENCE_WORKERS
+            prefix = f'QUEUE_{name.upper()}'
+            _queues[name] = ModelQueue(
+                name,
+                concurrency=int(os.environ.get(f'{prefix}_CONCURRENCY', concurrency)),
+                max_queue=int(os.environ.get(f'{prefix}_MAX', max_queue)),
+            )
+        return _queues[name]
+
+
+def queue_stats():
+    with _queues_lock:
+        queues = list(_queues.values())
+    return {queue.name: queue.stats() for queue in queues}
+
+
+# Kedalaman antrean, slot berjalan & jumlah request ditolak per model ikut diekspor di endpoint metrik
+metrics.register_stats('queues', queue_stats)
@@ -0,0 +1,102 @@
+"""
+Resolution Utils
+----------------
+Perencana resolusi output sebelum inference (bukan clamp setelah inference):
+- Hitung ukuran akhir (termasuk batas 3480px) terlebih dahulu
+- Pilih faktor resize input (pre-resize 2x untuk gambar kecil / downscale untuk gambar besar)
+  dan outscale model supaya model tidak pernah menghasilkan piksel di atas batas
+- Mode wajah: output GFPGANer = input x scale, jadi hanya ukuran itu yang dibatasi; output tidak pernah
+  di-resize naik setelah inference
+- Laporan jumlah piksel & estimasi waktu yang dihemat per request
+
+Created by _drat | 2025
+"""
+
+# Batas sisi terpanjang hasil enhance (sama seperti sebelumnya di app_enhance)
+MAX_OUTPUT_SIZE = 3480
+# Gambar dengan tinggi di bawah ini diperbesar 2x sebelum enhance
+SMALL_IMAGE_HEIGHT = 300
+# Faktor upscale native SRVGGNetCompact (realesr-general-x4v3)
+NATIVE_SCALE = 4
+
+
+# Fungsi clamp ukuran (logika yang sama dengan clamp lama di app_enhance)
+def clamp_size(w, h, max_size=MAX_OUTPUT_SIZE):
+    if h > max_size:
+        w = int(w * max_size / h)
+        h = max_size
+    if w > max_size:
+        h = int(h * max_size / w)
+        w = max_size
+    return w, h
+
+
+class ResolutionPlan:
+    def __init__(self, width, height, scale, enhance_mode, max_size=MAX_OUTPUT_SIZE):
+        scale = int(scale)
+        self.input_size = (width, height)
+        self.scale = scale
+        self.enhance_mode = enhance_mode
+
+        # Ukuran akhir, identik dengan pipeline lama (pre-resize 2x -> upscale -> clamp)
+        pre_scale = 2 if height < SMALL_IMAGE_HEIGHT else 1
+        self.target_size = clamp_size(width * pre_scale * scale, height * pre_scale * scale, max_size)
+
+        # Faktor output "mentah" model: Real-ESRGAN selalu 4x (juga sebagai bg upsampler), GFPGAN saja = scale
+        self.model_scale = scale if enhance_mode == "Only Face Enhance" else NATIVE_SCALE
+        model_factor = max(self.model_scale, scale)
+
+        # Faktor yang menentukan batas input: Real-ESRGAN saja = 4x mentah model (sisa outscale diatur di upsampler);
+        # mode wajah = scale, karena GFPGANer (paste_faces_to_input_image) mengembalikan input x scale dan
+        # 4x internal bg upsampler sudah di-resize ke scale di dalamnya
+        face_mode = enhance_mode != "Only Image Enhance"
+        output_factor = scale if face_mode else NATIVE_SCALE
+
+        # Pre-resize & downscale digabung jadi satu faktor resize input
+        longest = max(width, height) * pre_scale
+        limit = min(1.0, max_size / (longest * output_factor))
+        self.input_factor = pre_scale * limit
+        if self.input_factor == 1:
+            self.resized_size = (width, height)
+        else:
+            self.resized_size = (max(1, round(width * self.input_factor)), max(1, round(height * self.input_factor)))
+        if face_mode:
+            # Ukuran output GFPGANer yang sebenarnya (int(sisi x scale)), supaya tidak ada resize setelah inference
+            self.target_size = (int(self.resized_size[0] * scale), int(self.resized_size[1] * scale))
+
+        # Outscale yang diminta ke upsampler (dibatasi 4x); target = ukuran yang benar-benar dihasilkan upsampler
+        # (int(sisi x outscale) seperti RealESRGANer.enhance), jadi tidak ada resize setelah inference
+        self.outscale = min(float(NATIVE_SCALE), self.target_size[0] / self.resized_size[0])
+        if not face_mode:
+            self.target_size = (int(self.resized_size[0] * self.outscale), int(self.resized_size[1] * self.outscale))
+
+        # Jumlah piksel output model: pipeline lama vs rencana baru
+        self.baseline_pixels = (width * pre_scale * model_factor) * (height * pre_scale * model_factor)
+        self.planned_pixels = (self.resized_size[0] * model_factor) * (self.resized_size[1] * model_factor)
+
+    @property
+    def needs_input_resize(self):
+        return self.resized_size != self.input_size
+
+    # Laporan penghematan (estimasi waktu baseline diskalakan linear dengan jumlah piksel)
+    def report(self, inference_seconds=None):
+        saved_pixels = max(0, self.baseline_pixels - self.planned_pixels)
+        report = {
+            'input_size': self.input_size,
+            'resized_size': self.resized_size,
+            'target_size': self.target_size,
+            'outscale': self.outscale,
+            'baseline_pixels': self.baseline_pixels,
+            'planned_pixels': self.planned_pixels,
+            'saved_pixels': saved_pixels,
+        }
+        if inference_seconds is not None and self.planned_pixels:
+            baseline_seconds = inference_seconds * self.baseline_pixels / self.planned_pixels
+            report['inference_seconds'] = inference_seconds
+            report['saved_seconds'] = max(0.0, baseline_seconds - inference_seconds)
+        return report
+
+
+# Fungsi pembuat rencana resolusi untuk satu request
+def plan_resolution(width, height, scale, enhance_mode, max_size=MAX_OUTPUT_SIZE):
+    return ResolutionPlan(width, height, scale, enhance_mode, max_size)
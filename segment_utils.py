@@ -5,111 +5,197 @@ Utilitas segmentasi gambar berbasis MediaPipe dan mask biner untuk aplikasi imag
 - Segmentasi area: wajah, rambut, pakaian, dll.
 - Membuat dan mengelola mask hasil segmentasi serta integrasi dengan class Croper
 - Mendukung proses restore hasil generate ke gambar asli
+- Multi-region: beberapa kategori / beberapa area (misal tiap wajah di foto grup) dari satu kali segmentasi,
+  lalu semua hasil generate ditempel kembali ke satu salinan gambar asli
 
 Created by _drat | 2025
 """
 
+import os
 import numpy as np
 import mediapipe as mp
-import uuid
-import os
 
 from PIL import Image
 from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
-from scipy.ndimage import binary_dilation
 from croper import Croper
-
-# Inisialisasi model segmentasi MediaPipe (load tflite model untuk multiclass selfie segmentation)
+from output_utils import output_store
+from trace_utils import span
+from cache_utils import ArrayCache, hash_image
+from worker_utils import get_worker_pool, workers_enabled
+from mask_utils import (
+    CATEGORY_LABELS,
+    category_region_masks,
+    category_target_mask,
+    scale_dilation,
+    upsample_mask,
+    working_size_for,
+)
+
+# Model segmentasi MediaPipe (tflite multiclass selfie segmentation), dibuat saat pertama dipakai
 segment_model = "checkpoints/selfie_multiclass_256x256.tflite"
-base_options = python.BaseOptions(model_asset_path=segment_model)
-options = vision.ImageSegmenterOptions(base_options=base_options, output_category_mask=True)
-segmenter = vision.ImageSegmenter.create_from_options(options)
+segmenter = None
+
+# Restore tanpa segmentasi ulang hasil generate: mask restore = corp_mask saja (mask target asli di dilation 0
+# adalah subset corp_mask, jadi menggabungkannya tidak menambah apa-apa). Lebih cepat (tanpa MediaPipe kedua),
+# tapi area yang melebar di hasil generate tidak ikut di-restore; default mati (segmentasi ulang)
+RESTORE_REUSE_SEGMENTATION = os.environ.get('RESTORE_REUSE_SEGMENTATION', '0') == '1'
+# Ukuran kerja segmentasi (sisi terpanjang); 0 = segmentasi di resolusi penuh.
+# Model MediaPipe hanya bekerja di 256x256, jadi gambar besar cukup diproses di ukuran kecil lalu mask akhirnya di-upsample
+SEGMENT_WORKING_SIZE = int(os.environ.get('SEGMENT_WORKING_SIZE', 0))
+# Pecah setiap kategori menjadi region per connected component (misal tiap wajah di foto grup).
+# Default mati: satu crop per kategori seperti sebelumnya (setiap region tambahan = satu crop SD x4 lagi, dan
+# textbox kategori di UI tersembunyi, jadi pengguna tidak bisa memilihnya); aktifkan dengan SPLIT_REGIONS=1
+SPLIT_REGIONS = os.environ.get('SPLIT_REGIONS', '0') == '1'
+# Cache mask kategori per hash gambar, supaya edit berulang pada upload yang sama tidak menjalankan MediaPipe lagi
+segmentation_cache = ArrayCache(max_mb=int(os.environ.get('SEGMENT_CACHE_MB', 256)), name='segmentation')
+
+# Fungsi untuk mengambil segmenter (lazy; bisa diganti stand-in untuk benchmark offline)
+def get_segmenter():
+    global segmenter
+    if segmenter is None:
+        base_options = python.BaseOptions(model_asset_path=segment_model)
+        options = vision.ImageSegmenterOptions(base_options=base_options, output_category_mask=True)
+        segmenter = vision.ImageSegmenter.create_from_options(options)
+    return segmenter
+
+# Fungsi segmentasi MediaPipe -> mask kategori (uint8, read-only), dengan cache per hash gambar
+def segment_category_mask(input_image, use_cache=True):
+    key = hash_image(input_image) if use_cache else None
+    if key is not None:
+        cached = segmentation_cache.get(key)
+        if cached is not None:
+            return cached
+
+    if workers_enabled():
+        # Segmentasi di worker process (INFERENCE_WORKERS > 0), mask dibaca dari shared memory
+        category_mask_np = get_worker_pool().segment(input_image)
+    else:
+        image = mp.Image(image_format=mp.ImageFormat.SRGB, data=np.asarray(input_image))
+        segmentation_result = get_segmenter().segment(image)
+        # Salin dari memori MediaPipe supaya aman disimpan setelah objek hasil segmentasi dilepas
+        category_mask_np = np.array(segmentation_result.category_mask.numpy_view())
+    category_mask_np.flags.writeable = False
+
+    if key is not None:
+        segmentation_cache.put(key, category_mask_np)
+    return category_mask_np
 
 # Fungsi untuk mengembalikan hasil generate ke gambar asli, dengan mask transparan hasil segmentasi
-def restore_result(croper, category, generated_image):
-    square_length = croper.square_length
-    generated_image = generated_image.resize((square_length, square_length))
+def restore_result(croper, category, generated_image, reuse_segmentation=RESTORE_REUSE_SEGMENTATION):
+    return restore_regions(croper.input_image, [(croper, category)], [generated_image], reuse_segmentation)
 
-    # Crop area hasil generate, lalu buat mask hasil restore
-    cropped_generated_image = generated_image.crop((croper.square_start_x, croper.square_start_y, croper.square_end_x, croper.square_end_y))
-    cropped_square_mask_image = get_restore_mask_image(croper, category, cropped_generated_image)
+# Fungsi restore banyak region sekaligus: semua hasil generate ditempel ke satu salinan gambar asli
+def restore_regions(input_image, regions, generated_images, reuse_segmentation=RESTORE_REUSE_SEGMENTATION):
+    with span('restore', size=input_image.size, regions=len(regions)):
+        restored_image = input_image.copy()
+        for (croper, category), generated_image in zip(regions, generated_images):
+            square_length = croper.square_length
+            generated_image = generated_image.resize((square_length, square_length))
 
-    # Tempel hasil generate ke gambar asli dengan mask transparan
-    restored_image = croper.input_image.copy()
-    restored_image.paste(cropped_generated_image, (croper.origin_start_x, croper.origin_start_y), cropped_square_mask_image)
+            # Crop area hasil generate, lalu buat mask hasil restore
+            cropped_generated_image = generated_image.crop((croper.square_start_x, croper.square_start_y, croper.square_end_x, croper.square_end_y))
+            cropped_square_mask_image = get_restore_mask_image(croper, category, cropped_generated_image, reuse_segmentation)
 
-    extension = 'png'
-    tmpPrefix = "/tmp/gradio/"
-    # targetDir = f"{tmpPrefix}output/"
-    targetDir = "output/"
-    if not os.path.exists(targetDir):
-        os.makedirs(targetDir)
+            # Tempel hasil generate ke gambar asli dengan mask transparan
+            restored_image.paste(cropped_generated_image, (croper.origin_start_x, croper.origin_start_y), cropped_square_mask_image)
 
-    path = f"{targetDir}{uuid.uuid4()}.{extension}"
-    restored_image.save(path, quality=100)
+    # Simpan file hasil di background (path siap setelah output_store.wait / wait_for_output)
+    path = output_store.save(restored_image)
 
     return restored_image, path
 
-# Fungsi utama segmentasi gambar sesuai kategori
-def segment_image(input_image, category, input_size, mask_expansion, mask_dilation):
-    mask_size = int(input_size)
-    mask_expansion = int(mask_expansion)
+# Fungsi segmentasi (di resolusi penuh atau ukuran kerja) -> (mask kategori, ukuran kerja atau None)
+def _segment_for(input_image, working_size):
+    # Gambar besar diperkecil dulu ke ukuran kerja (segmentasi & logika mask dilakukan di ukuran ini)
+    small_size = working_size_for(input_image.size, working_size)
 
     # Konversi input image ke format yang sesuai untuk MediaPipe
-    image = mp.Image(image_format=mp.ImageFormat.SRGB, data=np.asarray(input_image))
-    segmentation_result = segmenter.segment(image)
-    category_mask = segmentation_result.category_mask
-    category_mask_np = category_mask.numpy_view()
-
-    # Pilih fungsi pembentukan mask sesuai kategori segmentasi
-    if category == "hair":
-        target_mask = get_hair_mask(category_mask_np, mask_dilation)
-    elif category == "clothes":
-        target_mask = get_clothes_mask(category_mask_np, mask_dilation)
-    elif category == "face":
-        target_mask = get_face_mask(category_mask_np, mask_dilation)
-    else:
-        target_mask = get_face_mask(category_mask_np, mask_dilation)
-    
-    # Buat objek Croper dengan mask hasil segmentasi, untuk crop & resize
-    croper = Croper(input_image, target_mask, mask_size, mask_expansion)
-    croper.corp_mask_image()
-    origin_area_image = croper.resized_square_image
-
-    return origin_area_image, croper  # Kembalikan area hasil crop + objek croper
+    with span('segmentation', size=input_image.size, working_size=small_size, model='selfie_multiclass_256x256'):
+        if small_size is None:
+            segment_input = input_image
+        else:
+            segment_input = input_image.resize(small_size, Image.BILINEAR, reducing_gap=2.0)
+        category_mask_np = segment_category_mask(segment_input)
+    return category_mask_np, small_size
+
+# Fungsi parsing daftar kategori dari input teks ("face, hair"); kategori tidak dikenal -> face
+def parse_categories(category):
+    categories = []
+    for name in str(category).split(','):
+        name = name.strip().lower()
+        name = name if name in CATEGORY_LABELS else 'face'
+        if name not in categories:
+            categories.append(name)
+    return categories
+
+# Fungsi segmentasi multi-region: satu segmentasi -> region per kategori (dan per connected component)
+# Mengembalikan (daftar area crop, daftar (croper, kategori)) dengan urutan yang sama
+def segment_regions(input_image, categories, input_size, mask_expansion, mask_dilation,
+                    split_components=SPLIT_REGIONS, working_size=SEGMENT_WORKING_SIZE):
+    mask_size = int(input_size)
+    mask_expansion = int(mask_expansion)
+    mask_dilation = int(mask_dilation)
+
+    category_mask_np, small_size = _segment_for(input_image, working_size)
+    if small_size is not None:
+        mask_dilation = scale_dilation(mask_dilation, small_size[0] / input_image.width)
+
+    with span('mask', categories=categories, dilation=mask_dilation, split=split_components) as attrs:
+        region_masks = []
+        for category in categories:
+            if split_components:
+                masks = category_region_masks(category_mask_np, category, mask_dilation)
+            else:
+                mask = category_target_mask(category_mask_np, category, mask_dilation)
+                masks = [mask] if mask.any() else []
+            region_masks.extend((category, mask) for mask in masks)
+        attrs['regions'] = len(region_masks)
+    if not region_masks:
+        raise ValueError('Mask kosong: tidak ada area yang tersegmentasi')
+
+    if small_size is not None:
+        with span('mask_upsample', size=input_image.size, working_size=small_size, regions=len(region_masks)):
+            region_masks = [(category, upsample_mask(mask, input_image.size, input_image)) for category, mask in region_masks]
+
+    origin_areas, regions = [], []
+    with span('cropping', size=input_image.size, mask_size=mask_size, regions=len(region_masks)):
+        for category, target_mask in region_masks:
+            croper = Croper(input_image, target_mask, mask_size, mask_expansion)
+            croper.corp_mask_image()
+            origin_areas.append(croper.resized_square_image)
+            regions.append((croper, category))
+    return origin_areas, regions
+
+# Fungsi utama segmentasi gambar sesuai kategori: satu region (tanpa pemecahan per connected component)
+# lewat jalur multi-region yang sama; kategori tidak dikenal -> face
+def segment_image(input_image, category, input_size, mask_expansion, mask_dilation, working_size=SEGMENT_WORKING_SIZE):
+    category = category if category in CATEGORY_LABELS else 'face'
+    origin_areas, regions = segment_regions(
+        input_image, [category], input_size, mask_expansion, mask_dilation,
+        split_components=False, working_size=working_size,
+    )
+    return origin_areas[0], regions[0][0]  # Kembalikan area hasil crop + objek croper
 
 # Fungsi pembuat mask khusus area wajah (+opsi dilasi mask)
 def get_face_mask(category_mask_np, dilation=1):
-    face_skin_mask = category_mask_np == 3
-    if dilation > 0:
-        face_skin_mask = binary_dilation(face_skin_mask, iterations=dilation)
-    return face_skin_mask
+    return category_target_mask(category_mask_np, 'face', dilation)
 
-# Fungsi pembuat mask khusus area baju (dan kulit tubuh)
+# Fungsi pembuat mask khusus area baju (dan kulit tubuh); selalu diperlebar 4 piksel + dilasi
 def get_clothes_mask(category_mask_np, dilation=1):
-    body_skin_mask = category_mask_np == 2
-    clothes_mask = category_mask_np == 4
-    combined_mask = np.logical_or(body_skin_mask, clothes_mask)
-    combined_mask = binary_dilation(combined_mask, iterations=4)
-    if dilation > 0:
-        combined_mask = binary_dilation(combined_mask, iterations=dilation)
-    return combined_mask
+    return category_target_mask(category_mask_np, 'clothes', dilation)
 
 # Fungsi pembuat mask khusus area rambut
 def get_hair_mask(category_mask_np, dilation=1):
-    hair_mask = category_mask_np == 1
-    if dilation > 0:
-        hair_mask = binary_dilation(hair_mask, iterations=dilation)
-    return hair_mask
+    return category_target_mask(category_mask_np, 'hair', dilation)
 
 # Fungsi untuk membuat mask kombinasi hasil generate dan area awal (untuk proses restore)
-def get_restore_mask_image(croper, category, generated_image):
-    image = mp.Image(image_format=mp.ImageFormat.SRGB, data=np.asarray(generated_image))
-    segmentation_result = segmenter.segment(image)
-    category_mask = segmentation_result.category_mask
-    category_mask_np = category_mask.numpy_view()
+def get_restore_mask_image(croper, category, generated_image, reuse_segmentation=RESTORE_REUSE_SEGMENTATION):
+    if reuse_segmentation:
+        return Image.fromarray((croper.corp_mask * 255).astype(np.uint8))
 
+    # Segmentasi ulang hasil generate (hasil generate selalu baru, jadi tidak di-cache)
+    category_mask_np = segment_category_mask(generated_image, use_cache=False)
     if category == "hair":
         target_mask = get_hair_mask(category_mask_np, 0)
     elif category == "clothes":
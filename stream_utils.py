@@ -0,0 +1,83 @@
+"""
+Stream Utils
+------------
+Utilitas preview bertahap (streaming) untuk endpoint Gradio berbasis generator:
+- Preview interpolasi murah yang langsung dikirim sebelum inference dimulai
+- Menjalankan fungsi blocking di thread terpisah dan meneruskan hasil parsial (tile / region) lewat generator
+- Throttle supaya hasil parsial tidak dikirim terlalu sering (biaya encode preview tetap kecil)
+
+Created by _drat | 2025
+"""
+
+import os
+import time
+import queue
+import threading
+import contextvars
+
+import numpy as np
+from PIL import Image
+
+# Sisi terpanjang gambar preview (preview di-resize, bukan ukuran output penuh)
+PREVIEW_MAX_SIZE = int(os.environ.get('PREVIEW_MAX_SIZE', 768))
+# Jeda minimum antar hasil parsial yang dikirim ke UI (detik)
+STREAM_MIN_INTERVAL_S = float(os.environ.get('STREAM_MIN_INTERVAL_S', 0.75))
+
+
+class Throttle:
+    # Membatasi frekuensi hasil parsial; ready() True paling cepat setiap min_interval detik
+    def __init__(self, min_interval: float = STREAM_MIN_INTERVAL_S):
+        self.min_interval = min_interval
+        self._last = time.monotonic()  # Preview awal baru saja dikirim
+
+    def ready(self):
+        now = time.monotonic()
+        if now - self._last < self.min_interval:
+            return False
+        self._last = now
+        return True
+
+
+# Fungsi ukuran preview (aspect ratio dipertahankan, sisi terpanjang <= max_size)
+def preview_size(size, max_size=PREVIEW_MAX_SIZE):
+    width, height = size
+    factor = min(1.0, max_size / max(width, height))
+    return max(1, round(width * factor)), max(1, round(height * factor))
+
+
+# Fungsi preview interpolasi murah: gambar input di-resize (bilinear) ke ukuran preview dari ukuran target
+def quick_preview(image: Image, target_size=None, max_size=PREVIEW_MAX_SIZE):
+    size = preview_size(target_size or image.size, max_size)
+    return image.convert('RGB').resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+
+# Fungsi gabung hasil parsial (RGB uint8) dengan preview dasar; area yang belum selesai memakai preview dasar
+def compose_preview(base: Image, partial: np.ndarray, coverage: np.ndarray):
+    height, width = partial.shape[:2]
+    base = np.asarray(base.resize((width, height), Image.BILINEAR))
+    return Image.fromarray(np.where(coverage[..., None], partial, base))
+
+
+# Generator: jalankan fn(emit, *args, **kwargs) di thread terpisah, yield setiap item dari emit(item),
+# lalu yield nilai return fn sebagai item terakhir. Exception dari fn diteruskan ke pemanggil generator
+def stream_call(fn, *args, **kwargs):
+    items = queue.Queue()
+
+    def emit(item):
+        items.put(('item', item))
+
+    def run():
+        try:
+            items.put(('result', fn(emit, *args, **kwargs)))
+        except BaseException as error:
+            items.put(('error', error))
+
+    # Context (trace request aktif) ikut dibawa ke thread pekerja
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), name='stream-worker', daemon=True).start()
+    while True:
+        kind, value = items.get()
+        if kind == 'error':
+            raise value
+        yield value
+        if kind == 'result':
+            return
@@ -0,0 +1,24 @@
+from resolution_utils import MAX_OUTPUT_SIZE, plan_resolution
+
+
+# Mode kombinasi: output GFPGANer = input x scale, jadi upload 1000px di scale 2 tidak boleh diperkecil
+def test_combined_scale2_keeps_input_size():
+    plan = plan_resolution(1000, 750, 2, "Face Enhance + Image Enhance")
+    assert plan.resized_size == (1000, 750)
+    assert not plan.needs_input_resize
+    assert plan.target_size == (2000, 1500)
+
+
+# Gambar besar di mode wajah: input dibatasi supaya input x scale <= batas, target = output GFPGANer
+def test_face_modes_limit_output_not_internal_4x():
+    for mode in ("Face Enhance + Image Enhance", "Only Face Enhance"):
+        plan = plan_resolution(3000, 2000, 2, mode)
+        assert max(plan.target_size) <= MAX_OUTPUT_SIZE
+        assert plan.target_size == (plan.resized_size[0] * 2, plan.resized_size[1] * 2)
+
+
+# Real-ESRGAN saja: 4x mentah model tetap dibatasi, target = ukuran yang dihasilkan upsampler (tanpa resize naik)
+def test_image_only_caps_native_4x():
+    plan = plan_resolution(1000, 750, 2, "Only Image Enhance")
+    assert max(plan.resized_size) * 4 <= MAX_OUTPUT_SIZE
+    assert plan.target_size == (int(plan.resized_size[0] * plan.outscale), int(plan.resized_size[1] * plan.outscale))
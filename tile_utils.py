@@ -0,0 +1,219 @@
+"""
+Tile Utils
+----------
+Inference Real-ESRGAN berbasis tile dengan batas memori:
+- Ukuran tile dipilih otomatis dari budget memori (bukan angka tile tetap)
+- Tile diproses paralel di thread pool
+- Sambungan antar tile di-blend (feathering linear) supaya tidak ada garis seam
+- Utilitas cek paritas hasil tile vs full-frame dalam batas toleransi
+- Callback per kelompok tile untuk preview bertahap (render hasil parsial yang sudah di-blend)
+- Jalur enhance hemat memori untuk gambar BGR uint8: konversi warna & skala dilakukan pada tensor,
+  output dikonversi ke uint8 sebelum keluar dari device (tanpa salinan float32 full-frame di numpy)
+
+Created by _drat | 2025
+"""
+
+import os
+import copy
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+from torch.nn import functional as F
+from realesrgan.utils import RealESRGANer
+
+# Konfigurasi default (bisa dioverride lewat environment variable)
+TILE_MEMORY_BUDGET_MB = int(os.environ.get('TILE_MEMORY_BUDGET_MB', 1024))  # Budget memori per forward pass
+TILE_WORKERS = int(os.environ.get('TILE_WORKERS', 2))                       # Jumlah thread paralel
+TILE_PAD = 32           # Konteks di sekitar tile (receptive field SRVGGNetCompact cukup lebar)
+MIN_TILE_SIZE = 64      # Tile terkecil yang masih efisien
+TILE_TOLERANCE = 2.0    # Selisih maksimum (level uint8) hasil tile vs full-frame
+
+
+# Fungsi estimasi memori aktivasi per piksel input untuk SRVGGNetCompact
+def bytes_per_pixel(num_feat=64, scale=4, dtype_bytes=4):
+    # Kira-kira 3 feature map aktif bersamaan + output pixel-shuffle (3*scale^2 channel) dua kali
+    return dtype_bytes * (3 * num_feat + 2 * 3 * scale * scale)
+
+
+# Fungsi untuk memilih sisi tile (tanpa padding) dari budget memori
+def plan_tile_size(memory_budget_mb, num_workers=1, tile_pad=TILE_PAD, num_feat=64, scale=4, dtype_bytes=4):
+    budget = memory_budget_mb * 1024 * 1024 / max(1, num_workers)
+    side = int(math.sqrt(budget / bytes_per_pixel(num_feat, scale, dtype_bytes))) - 2 * tile_pad
+    return max(MIN_TILE_SIZE, side)
+
+
+# Fungsi pembuat bobot feathering 1D untuk satu tile (ramp di sisi yang bersambung dengan tile lain)
+def _ramp(length, ramp_start, ramp_end):
+    weight = np.ones(length, dtype=np.float32)
+    if ramp_start > 0:
+        n = min(ramp_start, length)
+        weight[:n] = np.minimum(weight[:n], (np.arange(n, dtype=np.float32) + 0.5) / ramp_start)
+    if ramp_end > 0:
+        n = min(ramp_end, length)
+        weight[length - n:] = np.minimum(weight[length - n:], (np.arange(n, 0, -1, dtype=np.float32) - 0.5) / ramp_end)
+    return weight
+
+
+# Fungsi pembagi satu sumbu menjadi beberapa segmen (ukuran hampir sama)
+def _split_axis(size, tile_size):
+    count = max(1, math.ceil(size / tile_size))
+    bounds = np.linspace(0, size, count + 1).round().astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class TiledRealESRGANer(RealESRGANer):
+    def __init__(
+        self,
+        *args,
+        memory_budget_mb: int = TILE_MEMORY_BUDGET_MB,  # Budget memori (MB) untuk semua tile yang berjalan bersamaan
+        num_workers: int = TILE_WORKERS,                # Jumlah thread untuk memproses tile paralel
+        blend_pad: int = TILE_PAD,                      # Lebar overlap tiap sisi tile (piksel input)
+        **kwargs,
+    ):
+        kwargs.setdefault('tile', 0)  # tile=0 -> enhance() memanggil process(), yang memutuskan sendiri perlu tile atau tidak
+        super().__init__(*args, **kwargs)
+        self.memory_budget_mb = memory_budget_mb
+        self.num_workers = max(1, num_workers)
+        self.blend_pad = blend_pad
+        self.num_feat = getattr(self.model, 'num_feat', 64)
+        self.batch_scheduler = None  # Diisi batch_utils.enable_batching() jika micro-batching aktif
+        self.tile_callback = None    # Opsional: tile_callback(selesai, total, render) setelah tiap kelompok tile
+
+    # Salinan dangkal per request: model & scheduler dipakai bersama, state img/output terpisah
+    def for_request(self):
+        return copy.copy(self)
+
+    # Hook forward model (lewat scheduler micro-batching jika aktif)
+    def _forward(self, tensor):
+        if self.batch_scheduler is not None:
+            return self.batch_scheduler.submit(tensor).result()
+        with torch.no_grad():
+            return self.model(tensor)
+
+    # Override: untuk gambar BGR uint8 (kasus app), hasil identik dengan RealESRGANer.enhance tetapi
+    # tanpa salinan float32 HWC input (astype, /255, cvtColor) dan output (transpose, *255, round, astype)
+    @torch.no_grad()
+    def enhance(self, img, outscale=None, alpha_upsampler='realesrgan'):
+        if img.ndim != 3 or img.shape[2] != 3 or img.dtype != np.uint8:
+            return super().enhance(img, outscale=outscale, alpha_upsampler=alpha_upsampler)
+
+        h_input, w_input = img.shape[0:2]
+        # uint8 HWC BGR -> float NCHW RGB [0, 1] (nilai sama dengan img.astype(float32) / 255)
+        tensor = torch.from_numpy(img).to(self.device).permute(2, 0, 1)[[2, 1, 0]].float().div_(255.)
+        self.img = tensor.unsqueeze(0)
+        if self.half:
+            self.img = self.img.half()
+        self._pad_input()
+
+        if self.tile_size > 0:
+            self.tile_process()
+        else:
+            self.process()
+        output = self.post_process()
+
+        # Clamp, skala ke 0-255 & pembulatan di device, lalu transfer sebagai uint8 BGR HWC
+        output = output.data.squeeze(0).float().clamp_(0, 1).mul_(255.0).round_().to(torch.uint8)
+        output = output[[2, 1, 0]].permute(1, 2, 0).contiguous().cpu().numpy()
+        if outscale is not None and outscale != float(self.scale):
+            output = cv2.resize(output, (int(w_input * outscale), int(h_input * outscale)), interpolation=cv2.INTER_LANCZOS4)
+        return output, 'RGB'
+
+    # Padding input sama seperti RealESRGANer.pre_process (pre_pad reflect + mod pad untuk scale 1/2)
+    def _pad_input(self):
+        if self.pre_pad != 0:
+            self.img = F.pad(self.img, (0, self.pre_pad, 0, self.pre_pad), 'reflect')
+        if self.scale == 2:
+            self.mod_scale = 2
+        elif self.scale == 1:
+            self.mod_scale = 4
+        if self.mod_scale is not None:
+            self.mod_pad_h, self.mod_pad_w = 0, 0
+            _, _, h, w = self.img.size()
+            if h % self.mod_scale != 0:
+                self.mod_pad_h = self.mod_scale - h % self.mod_scale
+            if w % self.mod_scale != 0:
+                self.mod_pad_w = self.mod_scale - w % self.mod_scale
+            self.img = F.pad(self.img, (0, self.mod_pad_w, 0, self.mod_pad_h), 'reflect')
+
+    def _dtype_bytes(self):
+        return 2 if self.half else 4
+
+    # Override: full-frame jika muat di budget, selain itu tiled + paralel + blend
+    def process(self):
+        _, _, height, width = self.img.shape
+        need = height * width * bytes_per_pixel(self.num_feat, self.scale, self._dtype_bytes())
+        if need <= self.memory_budget_mb * 1024 * 1024:
+            self.output = self._forward(self.img)
+            return
+        tile_size = plan_tile_size(
+            self.memory_budget_mb, self.num_workers, self.blend_pad,
+            self.num_feat, self.scale, self._dtype_bytes()
+        )
+        self.output = self.blended_tile_process(self.img, tile_size)
+
+    # Proses tile paralel dengan overlap & feathering, hasil diakumulasi dengan bobot lalu dinormalisasi
+    def blended_tile_process(self, img, tile_size):
+        batch, channel, height, width = img.shape
+        scale = self.scale
+        pad = self.blend_pad
+        output = torch.zeros((batch, channel, height * scale, width * scale), dtype=torch.float32, device=img.device)
+        weight_sum = torch.zeros((1, 1, height * scale, width * scale), dtype=torch.float32, device=img.device)
+
+        tiles = [
+            (y0, y1, x0, x1)
+            for y0, y1 in _split_axis(height, tile_size)
+            for x0, x1 in _split_axis(width, tile_size)
+        ]
+
+        def run_tile(bounds):
+            y0, y1, x0, x1 = bounds
+            # Perluas tile dengan konteks (dibatasi tepi gambar)
+            py0, py1 = max(0, y0 - pad), min(height, y1 + pad)
+            px0, px1 = max(0, x0 - pad), min(width, x1 + pad)
+            tile_output = self._forward(img[:, :, py0:py1, px0:px1]).float()
+
+            # Ramp hanya di sisi yang bersambung dengan tile tetangga
+            weight_y = _ramp((py1 - py0) * scale, (y0 - py0) * 2 * scale, (py1 - y1) * 2 * scale)
+            weight_x = _ramp((px1 - px0) * scale, (x0 - px0) * 2 * scale, (px1 - x1) * 2 * scale)
+            weight = torch.from_numpy(np.outer(weight_y, weight_x)).to(tile_output.device)[None, None]
+            return (py0, py1, px0, px1), tile_output, weight
+
+        # Render hasil parsial (RGB uint8, sisi terpanjang <= max_size) + mask area yang sudah terisi
+        def render(max_size):
+            factor = min(1.0, max_size / max(height * scale, width * scale))
+            size = (max(1, round(height * scale * factor)), max(1, round(width * scale * factor)))
+            small = torch.nn.functional.interpolate(output, size=size, mode='area')
+            small_weight = torch.nn.functional.interpolate(weight_sum, size=size, mode='area')
+            image = (small / small_weight.clamp_min(1e-8)).clamp(0, 1)[0].permute(1, 2, 0)
+            return (image.cpu().numpy() * 255).round().astype(np.uint8), (small_weight[0, 0] > 0).cpu().numpy()
+
+        # Batasi jumlah tile yang "in flight" agar memori tetap sesuai budget
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            for start in range(0, len(tiles), self.num_workers):
+                for (py0, py1, px0, px1), tile_output, weight in executor.map(run_tile, tiles[start:start + self.num_workers]):
+                    oy0, oy1, ox0, ox1 = py0 * scale, py1 * scale, px0 * scale, px1 * scale
+                    output[:, :, oy0:oy1, ox0:ox1] += tile_output * weight
+                    weight_sum[:, :, oy0:oy1, ox0:ox1] += weight
+                if self.tile_callback is not None:
+                    self.tile_callback(min(start + self.num_workers, len(tiles)), len(tiles), render)
+
+        output /= weight_sum.clamp_min(1e-8)
+        return output.to(img.dtype)
+
+    # Fungsi cek paritas: bandingkan hasil tile vs full-frame (level uint8) untuk gambar BGR
+    def check_tile_parity(self, img, tile_size=None, tolerance=TILE_TOLERANCE):
+        tile_size = tile_size or max(MIN_TILE_SIZE, min(img.shape[:2]) // 2)
+        self.pre_process(img.astype(np.float32) / 255.)
+        full = self._forward(self.img).float()
+        tiled = self.blended_tile_process(self.img, tile_size).float()
+        diff = (full - tiled).abs().clamp(0, 1) * 255.
+        max_diff = float(diff.max())
+        return {
+            'max_diff': max_diff,
+            'mean_diff': float(diff.mean()),
+            'tile_size': tile_size,
+            'ok': max_diff <= tolerance,
+        }
@@ -0,0 +1,309 @@
+"""
+Trace Utils
+-----------
+Tracing & metrik terstruktur untuk pipeline enhance / upscale:
+- Span waktu per stage (segmentasi, crop, inference, restore, encoding) dengan atribut
+  seperti ukuran input, mode, dan nama model
+- Histogram latency, throughput, jumlah request in-flight, dan peak memori per stage
+  (RSS di-sampling selama span berjalan, peak GPU di-reset di awal setiap span)
+- Endpoint metrik (format Prometheus & JSON) dan breakdown waktu per request untuk UI,
+  termasuk statistik komponen (antrean, admission, cache, scheduler batching) yang mendaftarkan diri
+
+Created by _drat | 2025
+"""
+
+import os
+import json
+import time
+import resource
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Batas bucket histogram latency (detik)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Jendela waktu untuk menghitung throughput (detik)
+THROUGHPUT_WINDOW_S = 60
+# Cetak setiap span sebagai satu baris JSON (TRACE_LOG=1)
+TRACE_LOG = os.environ.get('TRACE_LOG', '0') == '1'
+# Interval sampling RSS selama ada span aktif (detik)
+PEAK_SAMPLE_INTERVAL_S = float(os.environ.get('PEAK_SAMPLE_INTERVAL_S', 0.02))
+
+# Trace milik request yang sedang berjalan (list span), None jika di luar request
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+# Fungsi membaca RSS proses saat ini (byte)
+def current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageMetrics:
+    def __init__(self):
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.peak_rss = 0
+        self.peak_gpu = 0
+        self.recent = deque()  # Timestamp span yang selesai (untuk throughput)
+
+    def observe(self, seconds, rss, gpu):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+        self.count += 1
+        self.total_seconds += seconds
+        self.peak_rss = max(self.peak_rss, rss)
+        self.peak_gpu = max(self.peak_gpu, gpu)
+        now = time.monotonic()
+        self.recent.append(now)
+        while self.recent and now - self.recent[0] > THROUGHPUT_WINDOW_S:
+            self.recent.popleft()
+
+    def throughput(self):
+        now = time.monotonic()
+        return sum(1 for t in self.recent if now - t <= THROUGHPUT_WINDOW_S) / THROUGHPUT_WINDOW_S
+
+
+# Fungsi meratakan dict statistik bertingkat -> {'a_b_c': angka}, nilai non-angka dilewati
+def _flatten_stats(stats, prefix=''):
+    flat = {}
+    for key, value in stats.items():
+        name = f'{prefix}_{key}' if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(_flatten_stats(value, name))
+        elif isinstance(value, (bool, int, float)):
+            flat[name] = float(value)
+    return flat
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.stages = {}
+        self.in_flight = 0
+        self.sources = {}  # Nama komponen -> fungsi stats() (antrean, admission, cache, scheduler, dll)
+        self._lock = threading.Lock()
+
+    # Daftarkan fungsi statistik komponen; hasilnya ikut diekspor di /metrics & /metrics.json
+    def register_stats(self, name, stats_fn):
+        with self._lock:
+            self.sources[name] = stats_fn
+
+    def component_stats(self):
+        with self._lock:
+            sources = dict(self.sources)
+        components = {}
+        for name, stats_fn in sorted(sources.items()):
+            try:
+                components[name] = stats_fn()
+            except Exception as error:  # Statistik satu komponen tidak boleh menggagalkan scrape
+                components[name] = {'error': repr(error)}
+        return components
+
+    def observe(self, stage, seconds, rss, gpu=0):
+        with self._lock:
+            self.stages.setdefault(stage, StageMetrics()).observe(seconds, rss, gpu)
+
+    def add_in_flight(self, delta):
+        with self._lock:
+            self.in_flight += delta
+
+    # Snapshot metrik dalam bentuk dict (untuk JSON)
+    def snapshot(self):
+        with self._lock:
+            stages = {}
+            for stage, m in self.stages.items():
+                stages[stage] = {
+                    'count': m.count,
+                    'mean_ms': m.total_seconds / m.count * 1000 if m.count else 0.0,
+                    'buckets': dict(zip(LATENCY_BUCKETS, m.bucket_counts)),
+                    'throughput_per_s': m.throughput(),
+                    'peak_rss_bytes': m.peak_rss,
+                    'peak_gpu_bytes': m.peak_gpu,
+                }
+        return {'in_flight': self.in_flight, 'stages': stages, 'components': self.component_stats()}
+
+    # Metrik dalam format teks Prometheus
+    def prometheus(self):
+        lines = [
+            '# TYPE enhancer_in_flight_requests gauge',
+            f'enhancer_in_flight_requests {self.in_flight}',
+            '# TYPE enhancer_stage_latency_seconds histogram',
+        ]
+        with self._lock:
+            for stage, m in sorted(self.stages.items()):
+                for bound, count in zip(LATENCY_BUCKETS, m.bucket_counts):
+                    lines.append(f'enhancer_stage_latency_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'enhancer_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {m.count}')
+                lines.append(f'enhancer_stage_latency_seconds_sum{{stage="{stage}"}} {m.total_seconds}')
+                lines.append(f'enhancer_stage_latency_seconds_count{{stage="{stage}"}} {m.count}')
+                lines.append(f'enhancer_stage_throughput_per_second{{stage="{stage}"}} {m.throughput()}')
+                lines.append(f'enhancer_stage_peak_rss_bytes{{stage="{stage}"}} {m.peak_rss}')
+                lines.append(f'enhancer_stage_peak_gpu_bytes{{stage="{stage}"}} {m.peak_gpu}')
+        lines.append('# TYPE enhancer_component_stat gauge')
+        for name, stats in self.component_stats().items():
+            for stat, value in sorted(_flatten_stats(stats).items()):
+                lines.append(f'enhancer_component_stat{{component="{name}",stat="{stat}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# Registry metrik global
+metrics = MetricsRegistry()
+
+
+_cuda_available = None
+
+
+def _cuda():
+    global _cuda_available
+    if _cuda_available is None:
+        try:
+            import torch
+            _cuda_available = torch.cuda.is_available()
+        except ImportError:
+            _cuda_available = False
+    return _cuda_available
+
+
+# Peak GPU sejak reset terakhir (byte)
+def _gpu_peak_bytes():
+    if not _cuda():
+        return 0
+    import torch
+    return torch.cuda.max_memory_allocated()
+
+
+def _reset_gpu_peak():
+    if _cuda():
+        import torch
+        torch.cuda.reset_peak_memory_stats()
+
+
+class _Watch:
+    __slots__ = ('rss', 'gpu')
+
+    def __init__(self, rss):
+        self.rss = rss
+        self.gpu = 0
+
+
+class PeakTracker:
+    # Peak RSS & GPU per span: RSS di-sampling thread background selama ada span aktif; counter peak GPU
+    # di-reset di awal setiap span, nilai peak sebelum reset dimasukkan dulu ke semua span aktif
+    # (span bertingkat / paralel tetap mendapat peak selama durasinya sendiri)
+    def __init__(self, interval: float = PEAK_SAMPLE_INTERVAL_S):
+        self.interval = interval
+        self._active = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _fold_gpu(self):
+        peak = _gpu_peak_bytes()
+        for watch in self._active:
+            watch.gpu = max(watch.gpu, peak)
+
+    def begin(self):
+        watch = _Watch(current_rss())
+        with self._lock:
+            self._fold_gpu()
+            _reset_gpu_peak()
+            self._active.add(watch)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='peak-sampler', daemon=True)
+                self._thread.start()
+        return watch
+
+    def end(self, watch):
+        rss = current_rss()
+        with self._lock:
+            self._fold_gpu()
+            self._active.discard(watch)
+        watch.rss = max(watch.rss, rss)
+        return watch.rss, watch.gpu
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+            rss = current_rss()
+            with self._lock:
+                for watch in self._active:
+                    watch.rss = max(watch.rss, rss)
+
+
+peak_tracker = PeakTracker()
+
+
+# Context manager span: catat durasi stage + atribut (ukuran input, mode, model, dll)
+@contextmanager
+def span(stage, **attrs):
+    watch = peak_tracker.begin()
+    start = time.perf_counter()
+    try:
+        yield attrs  # Pemanggil boleh menambah atribut (misal: ukuran output) selama span berjalan
+    finally:
+        seconds = time.perf_counter() - start
+        rss, gpu = peak_tracker.end(watch)
+        metrics.observe(stage, seconds, rss, gpu)
+        record = {'stage': stage, 'ms': round(seconds * 1000, 2), **attrs}
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.append(record)
+        if TRACE_LOG:
+            print(json.dumps(record, default=str))
+
+
+# Context manager satu request: mengumpulkan semua span di dalamnya + menghitung request in-flight
+@contextmanager
+def request_trace(name, **attrs):
+    trace = []
+    token = _current_trace.set(trace)
+    metrics.add_in_flight(1)
+    try:
+        with span(name, **attrs):
+            yield trace
+    finally:
+        metrics.add_in_flight(-1)
+        _current_trace.reset(token)
+
+
+# Fungsi ringkasan breakdown waktu per request (untuk ditampilkan di UI)
+def breakdown(trace):
+    return {
+        'total_ms': trace[-1]['ms'] if trace else 0.0,
+        'stages': {record['stage']: record['ms'] for record in trace[:-1]},
+        'spans': trace,
+    }
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith('/metrics.json'):
+            body, content_type = json.dumps(metrics.snapshot(), default=str).encode(), 'application/json'
+        elif self.path.startswith('/metrics'):
+            body, content_type = metrics.prometheus().encode(), 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Jangan spam log untuk setiap scrape
+
+
+# Fungsi untuk menjalankan endpoint metrik (/metrics & /metrics.json) di thread background
+def start_metrics_server(port, host='0.0.0.0'):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
@@ -0,0 +1,293 @@
+"""
+Worker Utils
+------------
+Backend inference opsional di luar proses server Gradio (process pool):
+- Setiap worker process me-load Real-ESRGAN, GFPGANer & segmenter sekali (lewat provider model_utils / segment_utils)
+- Gambar input & output dipindahkan lewat multiprocessing.shared_memory (tanpa pickling piksel);
+  lewat pipe hanya dikirim nama blok shared memory, shape, dtype & parameter
+- Worker yang crash / macet otomatis di-restart, request yang sedang berjalan gagal dengan WorkerCrashedError
+- Jumlah thread torch per worker = jumlah core / jumlah worker, jadi throughput naik seiring jumlah worker
+- Aktif jika INFERENCE_WORKERS > 0 (default 0 = inference di proses server seperti sebelumnya)
+
+Created by _drat | 2025
+"""
+
+import os
+import time
+import queue
+import atexit
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from trace_utils import span
+
+# Jumlah worker process inference (0 = nonaktif, inference di proses server)
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 0))
+# Thread torch per worker (0 = jumlah core / jumlah worker)
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', 0))
+# Batas waktu satu task & batas waktu worker siap (load model) sebelum dianggap macet lalu di-restart (detik)
+WORKER_TIMEOUT_S = float(os.environ.get('WORKER_TIMEOUT_S', 300))
+WORKER_START_TIMEOUT_S = float(os.environ.get('WORKER_START_TIMEOUT_S', 600))
+# Load model default saat worker start (bukan saat task pertama)
+WORKER_WARMUP = os.environ.get('WORKER_WARMUP', '1') == '1'
+
+# True di dalam worker process (supaya task tidak di-dispatch ulang ke worker lain)
+_in_worker = False
+
+
+class WorkerCrashedError(RuntimeError):
+    pass
+
+
+# Fungsi alokasi blok shared memory untuk array (shape, dtype); return (blok, view ndarray, spec untuk worker)
+def create_shared_array(shape, dtype=np.uint8):
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf), (shm.name, tuple(shape), dtype.str)
+
+
+# Fungsi attach ke blok shared memory dari spec (di worker); view harus dihapus sebelum blok di-close
+def attach_shared_array(spec):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+# Task: enhance (Real-ESRGAN / GFPGAN) gambar RGB, hasil ditulis langsung ke buffer output
+def _task_enhance(image, output, scale, enhance_mode):
+    from PIL import Image
+    from app_enhance import run_enhance
+
+    result = run_enhance(Image.fromarray(image), scale, enhance_mode)
+    np.copyto(output, np.asarray(result))
+
+
+# Task: segmentasi MediaPipe -> mask kategori (tanpa cache; cache ada di proses server)
+def _task_segment(image, output):
+    from segment_utils import segment_category_mask
+
+    np.copyto(output, segment_category_mask(image, use_cache=False))
+
+
+TASKS = {
+    'enhance': _task_enhance,
+    'segment': _task_segment,
+}
+
+
+# Fungsi load model default di worker (Real-ESRGAN, GFPGANer scale 2 wajah saja & kombinasi, segmenter)
+def _warmup_worker():
+    from model_utils import warmup
+    from segment_utils import get_segmenter
+
+    warmup(face_scales=(2,))
+    get_segmenter()
+
+
+# Loop utama worker process: terima (task, spec input, spec output, parameter), balas ('ok', detik) / ('error', pesan)
+def _worker_main(conn, threads, initializer):
+    global _in_worker
+    _in_worker = True
+
+    import torch
+
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if initializer is not None:
+        initializer()  # Misal: pasang model stand-in untuk benchmark offline
+    if WORKER_WARMUP:
+        _warmup_worker()
+    conn.send(('ready', os.getpid()))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break  # Proses server sudah berhenti
+        if message is None:
+            break
+        task, input_spec, output_spec, params = message
+        input_shm, image = attach_shared_array(input_spec)
+        output_shm, output = attach_shared_array(output_spec)
+        try:
+            start = time.perf_counter()
+            TASKS[task](image, output, **params)
+            conn.send(('ok', time.perf_counter() - start))
+        except Exception as error:
+            conn.send(('error', f'{type(error).__name__}: {error}'))
+        finally:
+            del image, output
+            input_shm.close()
+            output_shm.close()
+
+
+class InferenceWorker:
+    def __init__(self, index, context, threads, initializer=None):
+        self.index = index
+        self.context = context
+        self.threads = threads
+        self.initializer = initializer
+        self.restarts = 0
+        self.start()
+
+    def start(self):
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_worker_main, args=(child_conn, self.threads, self.initializer),
+            name=f'inference-worker-{self.index}', daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.ready = False
+
+    # Kirim satu task & tunggu balasan; EOFError / OSError / TimeoutError berarti worker crash atau macet
+    def call(self, message, timeout):
+        if not self.ready:
+            if not self.conn.poll(WORKER_START_TIMEOUT_S):
+                raise TimeoutError(f'worker {self.index} tidak siap dalam {WORKER_START_TIMEOUT_S:.0f}s')
+            self.conn.recv()  # ('ready', pid)
+            self.ready = True
+        self.conn.send(message)
+        if not self.conn.poll(timeout):
+            raise TimeoutError(f'task melewati batas waktu {timeout:.0f}s')
+        return self.conn.recv()
+
+    def restart(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.restarts += 1
+        print(f'[worker] inference-worker-{self.index} restart (exit code {self.process.exitcode}, restart ke-{self.restarts})')
+        self.start()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+
+class WorkerPool:
+    def __init__(
+        self,
+        workers: int = INFERENCE_WORKERS,
+        threads: int = WORKER_THREADS,          # 0 = jumlah core / jumlah worker
+        timeout_s: float = WORKER_TIMEOUT_S,
+        initializer=None,                       # Callable level modul yang dijalankan di setiap worker sebelum warmup
+    ):
+        workers = max(1, workers)
+        threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        # spawn: worker tidak mewarisi thread / state CUDA dari proses server
+        context = multiprocessing.get_context('spawn')
+        self.timeout_s = timeout_s
+        self.tasks = 0
+        self.failures = 0
+        self.workers = [InferenceWorker(index, context, threads, initializer) for index in range(workers)]
+        self._idle = queue.Queue()
+        for worker in self.workers:
+            self._idle.put(worker)
+        self._lock = threading.Lock()
+
+    # Jalankan task di worker yang sedang kosong (blocking sampai ada). Input disalin sekali ke shared memory,
+    # hasil dibaca dari buffer output lewat convert (harus menyalin, misal Image.fromarray RGB / np.array)
+    # sebelum blok dilepas
+    def run(self, task, image, output_shape, convert=np.array, **params):
+        image = np.asarray(image)
+        input_shm, input_view, input_spec = create_shared_array(image.shape, image.dtype)
+        try:
+            np.copyto(input_view, image)
+            output_shm, output_view, output_spec = create_shared_array(output_shape)
+            try:
+                self._dispatch(task, input_spec, output_spec, params, size=image.shape[1::-1])
+                return convert(output_view)
+            finally:
+                del output_view
+                output_shm.close()
+                output_shm.unlink()
+        finally:
+            del input_view
+            input_shm.close()
+            input_shm.unlink()
+
+    # Kirim task ke worker kosong; worker yang crash / macet di-restart & request gagal dengan WorkerCrashedError
+    def _dispatch(self, task, input_spec, output_spec, params, size):
+        worker = self._idle.get()
+        if not worker.process.is_alive():
+            # Worker mati saat idle (misal di-kill OOM killer): restart dulu, request ini tidak ikut gagal
+            worker.restart()
+        try:
+            with span(f'worker:{task}', worker=worker.index, size=size) as attrs:
+                try:
+                    status, value = worker.call((task, input_spec, output_spec, params), self.timeout_s)
+                except (EOFError, OSError, TimeoutError) as error:
+                    with self._lock:
+                        self.failures += 1
+                    worker.restart()
+                    raise WorkerCrashedError(f'Worker inference gagal ({error or type(error).__name__}), silakan coba lagi')
+                if status == 'error':
+                    raise RuntimeError(value)
+                attrs['worker_ms'] = round(value * 1000, 2)
+            with self._lock:
+                self.tasks += 1
+        finally:
+            self._idle.put(worker)
+
+    # Enhance di worker: ukuran output sudah diketahui dari perencana resolusi, hasil langsung jadi PIL Image
+    def enhance(self, input_image, scale, enhance_mode):
+        from PIL import Image
+        from resolution_utils import plan_resolution
+
+        if input_image.mode != 'RGB':
+            input_image = input_image.convert('RGB')
+        width, height = plan_resolution(input_image.width, input_image.height, scale, enhance_mode).target_size
+        return self.run(
+            'enhance', input_image, (height, width, 3), convert=Image.fromarray,
+            scale=int(scale), enhance_mode=enhance_mode,
+        )
+
+    # Segmentasi di worker: mask kategori seukuran input
+    def segment(self, image):
+        image = np.asarray(image)
+        return self.run('segment', image, image.shape[:2])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': len(self.workers),
+                'idle': self._idle.qsize(),
+                'tasks': self.tasks,
+                'failures': self.failures,
+                'restarts': sum(worker.restarts for worker in self.workers),
+            }
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+# Pool global (dibuat saat pertama dipakai)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Fungsi cek apakah inference dijalankan di worker process (bukan dari dalam worker itu sendiri)
+def workers_enabled():
+    return INFERENCE_WORKERS > 0 and not _in_worker
+
+
+def get_worker_pool() -> WorkerPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool()
+            atexit.register(_pool.shutdown)
+        return _pool